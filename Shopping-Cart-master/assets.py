@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    # 没装 brotli 时只生成 .gz；已经存在的 .br 仍然会用
+    brotli = None
+
+# 带内容哈希的地址可以让浏览器缓存一年，期间不再来验证
+MAX_AGE = 365 * 24 * 3600
+# 文本类文件预先压缩；图片本身已经压缩过
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.json', '.txt')
+# 按内容哈希命名的上传图片和它们的缩略图，文件名本身就是版本号
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{32}\.')
+# 服务端按优先顺序选用的压缩格式
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def fingerprint(filename, digest):
+    """css/home.css -> css/home.<hash>.css"""
+    stem, extension = os.path.splitext(filename)
+    return '{}.{}{}'.format(stem, digest[:12], extension)
+
+
+def compress(path):
+    """在文件旁边写 .gz（装了 brotli 时还有 .br），已经是最新的就跳过"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    mtime = os.path.getmtime(path)
+    encoders = [('.gz', lambda data: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+    for suffix, encode in encoders:
+        target = path + suffix
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        encoded = encode(data)
+        if len(encoded) >= len(data):
+            continue
+        temp = target + '.part'
+        with open(temp, 'wb') as f:
+            f.write(encoded)
+        os.replace(temp, target)
+
+
+class AssetManifest:
+    """启动时给 static 下的文件算内容哈希，url_for('static') 生成带哈希的地址
+
+    带哈希的地址和按哈希命名的上传图片用 Cache-Control: immutable 缓存一年，
+    文件内容一变地址就变，重复访问页面时浏览器不用再请求静态文件。
+    客户端接受时优先返回预先压缩好的 .br/.gz。
+    上传目录下启动后才出现的文件不在清单里，仍按原来的地址返回。
+    """
+
+    def __init__(self, app=None):
+        self.files = {}
+        self._reverse = {}
+        self._encoded = set()
+        self.folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.static_folder
+        self.build()
+        app.url_defaults(self.rewrite)
+        app.view_functions['static'] = self.serve
+
+    def build(self):
+        files = {}
+        encoded = set()
+        for root, dirs, names in os.walk(self.folder):
+            # 缩略图是后台生成的，文件名已经带了原图的哈希
+            dirs[:] = [name for name in dirs if name != 'variants']
+            for name in names:
+                if name.endswith(('.gz', '.br', '.part')):
+                    continue
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                if name.endswith(COMPRESSIBLE):
+                    try:
+                        compress(path)
+                    except OSError:
+                        # 只读目录，不预先压缩
+                        pass
+                    for encoding, suffix in ENCODINGS:
+                        if os.path.exists(path + suffix):
+                            encoded.add(filename + suffix)
+                if HASHED_NAME.search(filename):
+                    continue
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(64 * 1024), b''):
+                        digest.update(chunk)
+                files[filename] = fingerprint(filename, digest.hexdigest())
+        self.files = files
+        self._reverse = {versioned: filename for filename, versioned in files.items()}
+        self._encoded = encoded
+        return files
+
+    def rewrite(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def serve(self, filename):
+        original = self._reverse.get(filename)
+        immutable = original is not None or HASHED_NAME.search(filename) is not None
+        filename = original or filename
+        sent = filename
+        encoding = None
+        accepted = request.accept_encodings
+        for name, suffix in ENCODINGS:
+            if filename + suffix in self._encoded and accepted[name]:
+                encoding, sent = name, filename + suffix
+                break
+        response = send_from_directory(self.folder, sent, mimetype=mimetypes.guess_type(filename)[0], max_age=MAX_AGE if immutable else None)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if filename.endswith(COMPRESSIBLE):
+            response.vary.add('Accept-Encoding')
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+
+    def stats(self):
+        return {'files': len(self.files), 'precompressed': sorted(self._encoded)}
@@ -0,0 +1,136 @@
+import sys
+import threading
+from array import array
+
+
+class PrefixIndex:
+    """商品名的前缀索引：有序数组 + 二分查找，输入联想不需要访问数据库
+
+    名称里每个单词开头的后缀都是一个key，所以 "shi" 可以匹配到 "T Shirt 1"。
+    key 不单独存字符串，只存 (productId, 单词在名称里的偏移)，比较时再从名称里切出来；
+    两列放在平行的数组里，每个单词只占12字节。
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._ids = array('q')       # 按 key 排序的 productId
+        self._offsets = array('I')   # 与 _ids 对应的单词偏移
+        self._names = {}             # productId -> name
+        self._texts = {}             # productId -> 小写、空白合并后的名称，偏移指向这里
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(name):
+        name = name or ''
+        text = ' '.join(name.lower().split())
+        # 名称本来就是小写时共用同一个字符串
+        return name if text == name else text
+
+    @staticmethod
+    def _offsetsFor(text):
+        """每个单词开头在 text 里的位置"""
+        offsets = [0] if text else []
+        offsets.extend(i + 1 for i, char in enumerate(text) if char == ' ')
+        return offsets
+
+    def _key(self, i):
+        return self._texts[self._ids[i]][self._offsets[i]:]
+
+    def _bisect(self, key, right=False):
+        # bisect 模块在 3.10 之前不支持 key 参数
+        ids, offsets, texts = self._ids, self._offsets, self._texts
+        lo, hi = 0, len(ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            current = texts[ids[mid]][offsets[mid]:]
+            if current < key or (right and current == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def load(self, rows):
+        """从 (productId, name) 行整体重建索引"""
+        names = {}
+        texts = {}
+        entries = []
+        for productId, name in rows:
+            names[productId] = name or ''
+            text = texts[productId] = self._normalize(name)
+            entries.extend((productId, offset) for offset in self._offsetsFor(text))
+        # 排序时临时切出每个 key，排完就释放
+        entries.sort(key=lambda entry: texts[entry[0]][entry[1]:])
+        ids = array('q', (productId for productId, offset in entries))
+        offsets = array('I', (offset for productId, offset in entries))
+        with self._lock:
+            self._ids, self._offsets, self._names, self._texts = ids, offsets, names, texts
+            self.loaded = True
+
+    def invalidate(self):
+        """标记为未加载，下次查询时整体重新加载"""
+        with self._lock:
+            self.loaded = False
+
+    def add(self, productId, name):
+        with self._lock:
+            # 还没加载时不用维护，首次查询时会整体加载
+            if not self.loaded:
+                return
+            self._names[productId] = name or ''
+            text = self._texts[productId] = self._normalize(name)
+            for offset in self._offsetsFor(text):
+                i = self._bisect(text[offset:], right=True)
+                self._ids.insert(i, productId)
+                self._offsets.insert(i, offset)
+
+    def remove(self, productId):
+        with self._lock:
+            text = self._texts.get(productId)
+            if text is None:
+                return
+            for offset in self._offsetsFor(text):
+                key = text[offset:]
+                i = self._bisect(key)
+                while i < len(self._ids) and self._key(i) == key:
+                    if self._ids[i] == productId and self._offsets[i] == offset:
+                        del self._ids[i]
+                        del self._offsets[i]
+                        break
+                    i += 1
+            del self._texts[productId]
+            del self._names[productId]
+
+    def search(self, prefix, limit=10):
+        """返回名称中以 prefix 开头的单词序列匹配的商品 [(productId, name)]"""
+        prefix = self._normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self._lock:
+            i = self._bisect(prefix)
+            while i < len(self._ids) and len(results) < limit:
+                productId = self._ids[i]
+                if not self._texts[productId].startswith(prefix, self._offsets[i]):
+                    break
+                if productId not in seen:
+                    seen.add(productId)
+                    results.append((productId, self._names[productId]))
+                i += 1
+        return results
+
+    def stats(self):
+        with self._lock:
+            names = dict(self._names)
+            texts = dict(self._texts)
+            keys = len(self._ids)
+            size = sys.getsizeof(self._ids) + sys.getsizeof(self._offsets) + sys.getsizeof(names) + sys.getsizeof(texts)
+        # 估算内存：数组和字典本身 + 名称字符串（原样的和小写的）
+        size += sum(sys.getsizeof(name) for name in names.values())
+        size += sum(sys.getsizeof(text) for productId, text in texts.items() if text is not names[productId])
+        return {
+            'loaded': self.loaded,
+            'products': len(names),
+            'keys': keys,
+            'bytes': size,
+        }
@@ -0,0 +1,91 @@
+"""目录快照内存基准：每10万个商品，按列存放的快照和 fetchall() 元组列表各占多少内存
+
+用法: python benchmarks/bench_catalog.py [商品数]
+"""
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import database
+from catalog import Catalog
+
+PRODUCTS = 100000
+IMAGES = ['book{}.jpg'.format(i) for i in range(50)]
+WORDS = 'cotton shirt blue red classic novel laptop stand ring watch cable music vinyl'.split()
+
+
+def build_database(path, size):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    database.migrate(conn)
+    rng = random.Random(0)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO products (name, price, description, image, stock, categoryId) VALUES (?, ?, ?, ?, ?, ?)',
+        ((' '.join(rng.choice(WORDS) for _ in range(3)) + ' {}'.format(i),
+          round(rng.uniform(1, 500), 2),
+          ' '.join(rng.choice(WORDS) for _ in range(12)),
+          rng.choice(IMAGES),
+          rng.randint(0, 20),
+          rng.randint(1, 6)) for i in range(size)))
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def measure(load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main(size=PRODUCTS):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        build_database(path, size)
+        conn = sqlite3.connect(path)
+
+        def fetchRows():
+            # 原来各个页面的做法：整张表 fetchall() 成元组列表
+            return conn.execute('SELECT productId, name, price, description, image, stock, categoryId FROM products').fetchall()
+
+        rows, rowsBytes, rowsSeconds = measure(fetchRows)
+        del rows
+        catalog = Catalog()
+        snapshot, snapshotBytes, snapshotSeconds = measure(lambda: catalog.load(conn))
+        conn.close()
+
+        scale = 100000 / size
+        print('{} products'.format(size))
+        print('{:<22}{:>12}{:>10}'.format('', 'MB/100k', 'load s'))
+        print('{:<22}{:>12.1f}{:>10.2f}'.format('fetchall() tuples', rowsBytes * scale / 1e6, rowsSeconds))
+        print('{:<22}{:>12.1f}{:>10.2f}'.format('column snapshot', snapshotBytes * scale / 1e6, snapshotSeconds))
+
+        ids = [snapshot.ids[i] for i in range(0, len(snapshot), max(len(snapshot) // 1000, 1))]
+        for name, lookup in (
+                ('by id', lambda: [snapshot.product(productId) for productId in ids]),
+                ('by category', lambda: snapshot.inCategory(3)),
+                ('price 100-110', lambda: snapshot.inPriceRange(100, 110)),
+                ('keyset page', lambda: snapshot.after(size // 2, 29))):
+            start = time.perf_counter()
+            result = lookup()
+            print('{:<22}{:>10.3f} ms ({} rows)'.format(name, (time.perf_counter() - start) * 1000, len(result)))
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,85 @@
+"""8个worker进程各自保存目录快照 vs 共用一个mmap文件时，每个进程的内存
+
+RSS 会把共享的映射页算进每个进程，PSS 按共享的进程数平摊，更接近真实占用。
+用法: python benchmarks/bench_catalog_rss.py [商品数] [worker数]
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from bench_catalog import build_database
+from catalog import Catalog
+
+PRODUCTS = 100000
+WORKERS = 8
+
+
+def memory():
+    """当前进程的 (RSS, PSS)，单位KB"""
+    values = {}
+    for name in ('/proc/self/status', '/proc/self/smaps_rollup'):
+        with open(name) as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('VmRSS', 'Pss'):
+                    values[key] = int(rest.split()[0])
+    return values['VmRSS'], values['Pss']
+
+
+def worker(database, path):
+    before = memory()
+    conn = sqlite3.connect(database)
+    snapshot = Catalog(path or None).load(conn, database)
+    conn.close()
+    # 像处理请求一样把每个商品都读一遍，映射的页都会被换入
+    for i in range(len(snapshot)):
+        snapshot.row(i)
+        snapshot.descriptions[i]
+    after = memory()
+    print(json.dumps({'before': before, 'after': after}), flush=True)
+    # 等所有 worker 都测完再退出，这样 PSS 是在共享状态下统计的
+    sys.stdin.read()
+
+
+def run(database, path, workers):
+    processes = [subprocess.Popen([sys.executable, __file__, '--worker', database, path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True) for _ in range(workers)]
+    results = [json.loads(process.stdout.readline()) for process in processes]
+    for process in processes:
+        process.stdin.close()
+        process.wait()
+    rss = [result['after'][0] - result['before'][0] for result in results]
+    pss = [result['after'][1] - result['before'][1] for result in results]
+    return sum(rss) / workers / 1024, sum(pss) / workers / 1024, sum(pss) / 1024
+
+
+def main(size=PRODUCTS, workers=WORKERS):
+    fd, database = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    path = database + '.catalog'
+    try:
+        build_database(database, size)
+        # 先写好快照文件，worker 启动时直接映射
+        conn = sqlite3.connect(database)
+        Catalog(path).load(conn, database)
+        conn.close()
+        print('{} products, {} workers, snapshot file {:.1f} MB'.format(size, workers, os.path.getsize(path) / 1e6))
+        print('{:<20}{:>16}{:>16}{:>16}'.format('', 'RSS/worker MB', 'PSS/worker MB', 'PSS total MB'))
+        for name, mapped in (('per-process', ''), ('mmap', path)):
+            print('{:<20}{:>16.1f}{:>16.1f}{:>16.1f}'.format(name, *run(database, mapped, workers)))
+    finally:
+        for name in (database, database + '-wal', database + '-shm', path):
+            if os.path.exists(name):
+                os.unlink(name)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        worker(sys.argv[2], sys.argv[3])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,89 @@
+"""下单并发基准测试：N 个线程同时购买同一个热门商品，检查是否超卖并统计吞吐量
+
+用法: python benchmarks/bench_checkout.py [线程数] [买家数] [库存]
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import database
+from main import app
+
+PASSWORD = 'benchpass'
+
+
+def build_database(path, buyers, stock):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    database.migrate(conn)
+    passwordHash = hashlib.md5(PASSWORD.encode()).hexdigest()
+    conn.execute('BEGIN')
+    conn.execute("INSERT INTO products (productId, name, price, description, image, stock, categoryId) VALUES (1, 'Hot item', 9.99, '', '', ?, 1)", (stock, ))
+    conn.executemany('INSERT INTO users (userId, password, email, firstName) VALUES (?, ?, ?, ?)',
+        ((i, passwordHash, 'buyer{}@example.com'.format(i), 'Buyer') for i in range(1, buyers + 1)))
+    conn.executemany('INSERT INTO kart (userId, productId, quantity) VALUES (?, 1, 1)', ((i, ) for i in range(1, buyers + 1)))
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def main(threads=16, buyers=400, stock=100):
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        build_database(path, buyers, stock)
+        app.config['DATABASE'] = path
+        app.config['DATABASE_POOL_SIZE'] = threads
+
+        # 先登录好所有买家，只统计下单阶段
+        clients = []
+        for i in range(1, buyers + 1):
+            client = app.test_client()
+            client.post('/login', data={'email': 'buyer{}@example.com'.format(i), 'password': PASSWORD})
+            clients.append(client)
+
+        placed = []
+        start = threading.Barrier(threads)
+
+        def worker(mine):
+            start.wait()
+            for client in mine:
+                response = client.post('/checkout')
+                placed.append(response.status_code == 302)
+
+        workers = [threading.Thread(target=worker, args=(clients[i::threads], )) for i in range(threads)]
+        began = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - began
+
+        conn = sqlite3.connect(path)
+        finalStock = conn.execute('SELECT stock FROM products WHERE productId = 1').fetchone()[0]
+        orders = conn.execute('SELECT count(*) FROM orders').fetchone()[0]
+        sold = conn.execute('SELECT coalesce(sum(quantity), 0) FROM order_items').fetchone()[0]
+        conn.close()
+
+        print('threads={} buyers={} stock={}'.format(threads, buyers, stock))
+        print('orders placed:   {} (responses: {} ok, {} out of stock)'.format(orders, placed.count(True), placed.count(False)))
+        print('units sold:      {}'.format(sold))
+        print('final stock:     {}'.format(finalStock))
+        print('oversold:        {}'.format(max(sold - stock, 0)))
+        print('checkouts/sec:   {:.0f}'.format(buyers / elapsed))
+        assert sold <= stock and finalStock == stock - sold
+    finally:
+        app.extensions.pop('sqlite_pool').close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.unlink(path + suffix)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
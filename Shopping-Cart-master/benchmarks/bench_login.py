@@ -0,0 +1,67 @@
+"""登录基准测试：用户表从1k增长到1M时 is_valid 的延迟
+
+用法: python benchmarks/bench_login.py [用户数 ...]
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+import database
+from main import app, is_valid
+
+SIZES = [1000, 10000, 100000, 1000000]
+ROUNDS = 2000
+PASSWORD = 'benchpass'
+
+
+def build_database(path, size):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    database.migrate(conn)
+    passwordHash = hashlib.md5(PASSWORD.encode()).hexdigest()
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO users (password, email, firstName) VALUES (?, ?, ?)',
+        ((passwordHash, 'user{}@example.com'.format(i), 'User') for i in range(size)))
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def measure(size):
+    """返回平均每次登录校验的耗时（微秒）"""
+    emails = ['user{}@example.com'.format(i * 7919 % size) for i in range(ROUNDS)]
+    with app.app_context():
+        assert is_valid(emails[0], PASSWORD)
+        assert not is_valid(emails[0], 'wrong')
+        start = time.perf_counter()
+        for email in emails:
+            is_valid(email, PASSWORD)
+        elapsed = time.perf_counter() - start
+    return elapsed / ROUNDS * 1e6
+
+
+def main(sizes):
+    print('{:>10}  {:>12}'.format('users', 'us/login'))
+    for size in sizes:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        try:
+            build_database(path, size)
+            app.config['DATABASE'] = path
+            print('{:>10}  {:>12.1f}'.format(size, measure(size)))
+        finally:
+            app.extensions.pop('sqlite_pool').close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -0,0 +1,90 @@
+"""流式渲染基准：10万个商品时首页和 /remove 的首字节时间、总时间和服务进程的内存峰值
+
+分别用 STREAM_PAGES=0（渲染完再发送）和 STREAM_PAGES=1 启动服务进程，
+内存峰值取 /proc/<pid>/status 里的 VmHWM：首页那一行是访问完首页时的峰值，/remove 那一行是再访问完 /remove 时的峰值。
+用法: python benchmarks/bench_stream.py [商品数]
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_root)
+
+from bench_catalog import build_database
+
+PRODUCTS = 100000
+SERVER = "import sys; sys.path.insert(0, {!r}); import main; main.app.run(port={}, threaded=True)"
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def peakRss(pid):
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+
+def fetch(url):
+    """返回 (首字节秒数, 总秒数, 字节数)"""
+    start = time.perf_counter()
+    with requests.get(url, stream=True, headers={'Accept-Encoding': 'identity'}) as response:
+        chunks = response.iter_content(64 * 1024)
+        size = len(next(chunks, b''))
+        first = time.perf_counter() - start
+        size += sum(len(chunk) for chunk in chunks)
+    return first, time.perf_counter() - start, size
+
+
+def run(database, stream):
+    port = freePort()
+    env = dict(os.environ, DATABASE=database, STREAM_PAGES='1' if stream else '0')
+    server = subprocess.Popen([sys.executable, '-c', SERVER.format(project_root, port)], env=env, cwd=project_root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = 'http://127.0.0.1:{}'.format(port)
+    try:
+        for _ in range(100):
+            try:
+                requests.get(base + '/debug-pool')
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        # 先把目录快照加载好，再量首页
+        fetch(base + '/')
+        results = [('/', ) + fetch(base + '/?after=1')]
+        baseline = peakRss(server.pid)
+        results.append(('/remove', ) + fetch(base + '/remove'))
+        return results, baseline, peakRss(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(size=PRODUCTS):
+    fd, database = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        build_database(database, size)
+        print('{} products'.format(size))
+        print('{:<12}{:<10}{:>10}{:>10}{:>10}{:>14}'.format('mode', 'page', 'TTFB ms', 'total ms', 'KB', 'peak RSS MB'))
+        for name, stream in (('buffered', False), ('streaming', True)):
+            results, baseline, peak = run(database, stream)
+            for (page, first, total, length), rss in zip(results, (baseline, peak)):
+                print('{:<12}{:<10}{:>10.1f}{:>10.1f}{:>10.0f}{:>14.1f}'.format(name, page, first * 1000, total * 1000, length / 1024, rss))
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.unlink(database + suffix)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
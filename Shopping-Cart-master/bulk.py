@@ -0,0 +1,226 @@
+"""商品批量导入/导出
+
+    python bulk.py import products.csv [--batch 5000] [--transaction 100000] [--resume] [--create-categories]
+    python bulk.py export products.jsonl
+
+文件格式按扩展名判断（.jsonl/.ndjson 为 JSON Lines，其余为 CSV），也可以用 --format 指定。
+字段是 name, price, description, image, stock, category；category 是分类名。
+导出还会带上 productId，导入时忽略它，商品总是新增。
+数据库和 main.py 一样从 DATABASE 环境变量读取，也可以用 --database 指定。
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+
+import database as schema
+
+FIELDS = ('productId', 'name', 'price', 'description', 'image', 'stock', 'category')
+BATCH = 5000
+TRANSACTION = 100000
+
+INSERT = 'INSERT INTO products (name, price, description, image, stock, categoryId) VALUES (?, ?, ?, ?, ?, ?)'
+
+# 逐行维护全文索引、变更日志和分类计数的触发器。导入时在事务里先删掉，
+# 插完一批后用一条 INSERT ... SELECT 补齐，提交前再建回来；事务回滚时它们也会恢复
+ROW_TRIGGERS = ('products_fts_insert', 'products_log_insert', 'category_counts_insert')
+
+
+def connect(path):
+    conn = sqlite3.connect(path, uri=path.startswith('file:'), isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    conn.execute('PRAGMA cache_size = -64000')
+    schema.migrate(conn)
+    return conn
+
+
+def guessFormat(path):
+    return 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+
+
+def readRecords(f, format):
+    """逐条产生字典，不把整个文件读进内存"""
+    if format == 'csv':
+        yield from csv.DictReader(f)
+        return
+    for line in f:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # 坏行交给 parseRecord 报告，不中断整个导入
+                yield None
+
+
+def parseRecord(conn, record, categories, createCategories):
+    """把一条记录转成 INSERT 的参数，数据不合法时抛出 ValueError"""
+    if not isinstance(record, dict):
+        raise ValueError('not a JSON object')
+    name = str(record.get('name') or '').strip()
+    if not name:
+        raise ValueError('missing name')
+    try:
+        price = float(record.get('price'))
+        stock = int(record.get('stock') or 0)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('bad price or stock')
+    # nan 会被 SQLite 存成 NULL；库存要放得进 SQLite 的整数
+    if not math.isfinite(price) or stock >= 2 ** 63:
+        raise ValueError('bad price or stock')
+    if price < 0 or stock < 0:
+        raise ValueError('negative price or stock')
+    category = str(record.get('category') or '').strip()
+    categoryId = categories.get(category)
+    if categoryId is None:
+        if not category or not createCategories:
+            raise ValueError('unknown category {!r}'.format(category))
+        categoryId = conn.execute('INSERT INTO categories (name) VALUES (?)', (category, )).lastrowid
+        categories[category] = categoryId
+    return (name, price, str(record.get('description') or ''), str(record.get('image') or ''), stock, categoryId)
+
+
+def suspendTriggers(conn):
+    triggers = conn.execute('SELECT sql FROM sqlite_master WHERE type = ? AND name IN ({})'.format(','.join('?' * len(ROW_TRIGGERS))), ('trigger', ) + ROW_TRIGGERS).fetchall()
+    for name in ROW_TRIGGERS:
+        conn.execute('DROP TRIGGER IF EXISTS ' + name)
+    return [sql for sql, in triggers]
+
+
+def catchUp(conn, lastId):
+    """补上被暂停的触发器本该做的事，只处理这个事务新插入的商品"""
+    conn.execute('INSERT INTO products_fts (rowid, name, description) SELECT productId, name, description FROM products WHERE productId > ?', (lastId, ))
+    conn.execute('''INSERT INTO category_counts (categoryId, products)
+		SELECT categoryId, count(*) FROM products WHERE productId > ? AND categoryId IS NOT NULL GROUP BY categoryId
+		ON CONFLICT (categoryId) DO UPDATE SET products = products + excluded.products''', (lastId, ))
+    # 一次导入可能有几十万行，只记一行 '*'，各进程直接丢掉整个商品缓存
+    conn.execute("INSERT INTO change_log (tableName, rowKey) VALUES ('products', '*')")
+
+
+def importFile(conn, path, format=None, batch=BATCH, transaction=TRANSACTION, resume=False, createCategories=False, log=sys.stderr):
+    """导入商品，返回 (导入行数, 跳过行数)
+
+    每 transaction 条记录提交一次，提交时把已处理的记录数写进 import_progress；
+    中途失败的话，用 resume=True 再导一次会跳过已经提交的部分。
+    """
+    source = os.path.abspath(path)
+    size = os.path.getsize(path)
+    progress = conn.execute('SELECT size, rowsDone FROM import_progress WHERE source = ?', (source, )).fetchone()
+    done = 0
+    if progress is not None:
+        if not resume:
+            raise ValueError('an import of {} stopped after {} records; rerun with --resume'.format(path, progress[1]))
+        if progress[0] != size:
+            raise ValueError('{} has changed since the interrupted import'.format(path))
+        done = progress[1]
+        print('resuming after {} records'.format(done), file=log)
+    categories = dict(conn.execute('SELECT name, categoryId FROM categories'))
+    imported = skipped = 0
+    start = time.perf_counter()
+    with open(path, newline='', encoding='utf-8') as f:
+        records = itertools.islice(enumerate(readRecords(f, format or guessFormat(path)), 1), done, None)
+        finished = False
+        while not finished:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                triggers = suspendTriggers(conn)
+                lastId = conn.execute('SELECT coalesce(max(productId), 0) FROM products').fetchone()[0]
+                count = inserted = 0
+                while count < transaction and not finished:
+                    wanted = min(batch, transaction - count)
+                    rows = []
+                    read = 0
+                    for number, record in itertools.islice(records, wanted):
+                        read += 1
+                        try:
+                            rows.append(parseRecord(conn, record, categories, createCategories))
+                        except ValueError as e:
+                            skipped += 1
+                            print('record {}: {}, skipped'.format(number, e), file=log)
+                    # 读到的比要的少，文件已经读完了
+                    count += read
+                    finished = read < wanted
+                    conn.executemany(INSERT, rows)
+                    inserted += len(rows)
+                if inserted:
+                    catchUp(conn, lastId)
+                done += count
+                if finished:
+                    conn.execute('DELETE FROM import_progress WHERE source = ?', (source, ))
+                else:
+                    conn.execute('INSERT OR REPLACE INTO import_progress (source, size, rowsDone, updatedAt) VALUES (?, ?, ?, ?)', (source, size, done, int(time.time())))
+                for sql in triggers:
+                    conn.execute(sql)
+                conn.execute('COMMIT')
+            except:
+                conn.rollback()
+                raise
+            imported += inserted
+            elapsed = time.perf_counter() - start
+            print('{} records, {} imported, {} skipped, {:.0f} rows/s'.format(done, imported, skipped, imported / elapsed if elapsed else 0), file=log)
+    conn.execute('PRAGMA optimize')
+    return imported, skipped
+
+
+def exportFile(conn, path, format=None, batch=BATCH):
+    """按 productId 顺序导出所有商品，返回导出行数；path 为 '-' 时写到标准输出"""
+    format = format or ('csv' if path == '-' else guessFormat(path))
+    cur = conn.execute('''SELECT products.productId, products.name, products.price, products.description, products.image, products.stock, categories.name
+		FROM products LEFT JOIN categories ON categories.categoryId = products.categoryId ORDER BY products.productId''')
+    f = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+    count = 0
+    try:
+        writer = csv.writer(f) if format == 'csv' else None
+        if writer:
+            writer.writerow(FIELDS)
+        for rows in iter(lambda: cur.fetchmany(batch), []):
+            if writer:
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import and export of products')
+    parser.add_argument('--database', default=os.environ.get('DATABASE', 'database.db'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    load = commands.add_parser('import')
+    load.add_argument('file')
+    load.add_argument('--format', choices=('csv', 'jsonl'))
+    load.add_argument('--batch', type=int, default=BATCH, help='rows per executemany call')
+    load.add_argument('--transaction', type=int, default=TRANSACTION, help='records per transaction')
+    load.add_argument('--resume', action='store_true', help='continue an interrupted import of the same file')
+    load.add_argument('--create-categories', action='store_true', help='add categories that do not exist yet')
+    dump = commands.add_parser('export')
+    dump.add_argument('file', help="output file, or '-' for stdout")
+    dump.add_argument('--format', choices=('csv', 'jsonl'))
+    args = parser.parse_args(argv)
+
+    conn = connect(args.database)
+    try:
+        if args.command == 'import':
+            start = time.perf_counter()
+            imported, skipped = importFile(conn, args.file, args.format, max(args.batch, 1), max(args.transaction, 1), args.resume, args.create_categories)
+            elapsed = time.perf_counter() - start
+            print('imported {} products in {:.1f}s ({:.0f} rows/s), skipped {}'.format(imported, elapsed, imported / elapsed if elapsed else 0, skipped), file=sys.stderr)
+        else:
+            print('exported {} products'.format(exportFile(conn, args.file, args.format)), file=sys.stderr)
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class CatalogSnapshot:
+    """某一时刻的商品目录，按列存放
+
+    每个商品占各个数组里的同一个位置，位置按 productId 升序排列，
+    所以按 id 查找和 keyset 分页都可以直接二分。数字列放在 array 里，
+    字符串列放在列表里，不为每个商品创建元组。
+    库存不在快照里：加入购物车就会改库存，需要的地方直接查数据库。
+    """
+
+    __slots__ = ('ids', 'prices', 'categoryIds', 'names', 'descriptions', 'images',
+                 'categories', '_categoryNames', '_byCategory', '_priceOrder', '_sortedPrices')
+
+    def __init__(self, products, categories):
+        """products 是按 productId 升序的 (productId, name, price, description, image, categoryId) 行"""
+        self.ids = array('q')
+        self.prices = array('d')
+        self.categoryIds = array('q')
+        self.names = []
+        self.descriptions = []
+        self.images = []
+        byCategory = {}
+        strings = {}    # 相同的图片名共用一个字符串对象
+        for productId, name, price, description, image, categoryId in products:
+            byCategory.setdefault(categoryId, array('q')).append(len(self.ids))
+            self.ids.append(productId)
+            self.prices.append(price)
+            self.categoryIds.append(categoryId if categoryId is not None else 0)
+            self.names.append(name)
+            self.descriptions.append(description)
+            self.images.append(strings.setdefault(image, image))
+        self.categories = list(categories)
+        self._categoryNames = dict(self.categories)
+        self._byCategory = byCategory
+        # 按价格排序的位置，用于价格区间查询
+        self._priceOrder = array('q', sorted(range(len(self.ids)), key=self.prices.__getitem__))
+        self._sortedPrices = array('d', (self.prices[i] for i in self._priceOrder))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, i):
+        """列表页用的 (productId, name, price, image)"""
+        return (self.ids[i], self.names[i], self.prices[i], self.images[i])
+
+    def _position(self, productId):
+        i = bisect_left(self.ids, productId)
+        if i < len(self.ids) and self.ids[i] == productId:
+            return i
+        return None
+
+    def product(self, productId):
+        """商品详情 (productId, name, price, description, image, categoryId)，不存在时返回 None"""
+        i = self._position(productId)
+        if i is None:
+            return None
+        return (self.ids[i], self.names[i], self.prices[i], self.descriptions[i], self.images[i], self.categoryIds[i])
+
+    def rows(self, productIds):
+        """按给定顺序返回这些商品的列表行，快照里没有的跳过"""
+        positions = (self._position(productId) for productId in productIds)
+        return [self.row(i) for i in positions if i is not None]
+
+    def after(self, productId, limit):
+        """productId 大于给定值的前 limit 个商品，按 id 升序"""
+        start = bisect_right(self.ids, productId)
+        return [self.row(i) for i in range(start, min(start + limit, len(self.ids)))]
+
+    def before(self, productId, limit):
+        """productId 小于给定值的最后 limit 个商品，按 id 降序"""
+        end = bisect_left(self.ids, productId)
+        return [self.row(i) for i in range(end - 1, max(end - limit, 0) - 1, -1)]
+
+    def inCategory(self, categoryId):
+        return [self.row(i) for i in self._byCategory.get(categoryId, ())]
+
+    def inPriceRange(self, low=None, high=None, categoryId=None):
+        """价格在 [low, high] 之间的商品，按价格升序；可以再限定分类"""
+        start = 0 if low is None else bisect_left(self._sortedPrices, low)
+        end = len(self._sortedPrices) if high is None else bisect_right(self._sortedPrices, high)
+        positions = self._priceOrder[start:end]
+        if categoryId is not None:
+            positions = [i for i in positions if self.categoryIds[i] == categoryId]
+        return [self.row(i) for i in positions]
+
+    def categoryName(self, categoryId):
+        return self._categoryNames.get(categoryId)
+
+    def memoryUsage(self):
+        """估算快照占用的字节数：数组、列表和其中的字符串"""
+        size = sum(sys.getsizeof(column) for column in (self.ids, self.prices, self.categoryIds, self.names, self.descriptions, self.images, self._priceOrder, self._sortedPrices))
+        size += sum(sys.getsizeof(positions) for positions in self._byCategory.values()) + sys.getsizeof(self._byCategory)
+        seen = set()
+        for column in (self.names, self.descriptions, self.images):
+            for value in column:
+                # 相同的字符串对象（例如重复的图片名）只算一次
+                if id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+        return size
+
+
+MAGIC = b'SHOPCAT1'
+HEADER = struct.Struct('<8sI')
+
+
+class StringColumn:
+    """映射文件里的一列字符串：偏移数组 + UTF-8 数据，读取时才解码"""
+
+    __slots__ = ('_offsets', '_data')
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self._offsets) - 1:
+            raise IndexError(i)
+        return str(self._data[self._offsets[i]:self._offsets[i + 1]], 'utf-8')
+
+
+class ImageColumn:
+    """图片名重复很多，文件里只存每个商品的图片编号"""
+
+    __slots__ = ('_index', '_names')
+
+    def __init__(self, index, names):
+        self._index = index
+        self._names = names
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        return self._names[self._index[i]]
+
+
+class MappedSnapshot(CatalogSnapshot):
+    """从 writeSnapshot 写出的文件 mmap 出来的只读快照
+
+    数字列直接是映射内存上的 memoryview，多个 worker 进程映射同一个文件时共用
+    同一份页缓存，不各自复制一份。查询方法全部继承自 CatalogSnapshot。
+    """
+
+    __slots__ = ('path', 'header', '_mmap')
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        magic, length = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError('not a catalog snapshot: ' + path)
+        self.header = json.loads(self._mmap[HEADER.size:HEADER.size + length])
+        view = memoryview(self._mmap)
+
+        def section(name, fmt=None):
+            offset, size = self.header['sections'][name]
+            data = view[offset:offset + size]
+            return data.cast(fmt) if fmt else data
+
+        def strings(name):
+            return StringColumn(section(name + 'Offsets', 'q'), section(name))
+
+        self.ids = section('ids', 'q')
+        self.prices = section('prices', 'd')
+        self.categoryIds = section('categoryIds', 'q')
+        self.names = strings('names')
+        self.descriptions = strings('descriptions')
+        imageNames = strings('images')
+        self.images = ImageColumn(section('imageIndex', 'q'), [imageNames[i] for i in range(len(imageNames))])
+        categoryNames = strings('categoryNames')
+        self.categories = [(categoryId, categoryNames[i]) for i, categoryId in enumerate(section('categoryTable', 'q'))]
+        self._categoryNames = dict(self.categories)
+        positions = section('categoryPositions', 'q')
+        self._byCategory = {int(categoryId): positions[start:end] for categoryId, (start, end) in self.header['byCategory'].items()}
+        self._priceOrder = section('priceOrder', 'q')
+        self._sortedPrices = section('sortedPrices', 'd')
+
+    def memoryUsage(self):
+        # 文件是各进程共享的，这里报告映射的大小
+        return len(self._mmap)
+
+
+def writeSnapshot(snapshot, path, **meta):
+    """把快照写成一个文件：先写临时文件再 rename，读的进程不会看到写了一半的文件"""
+    def strings(values):
+        encoded = [(value or '').encode() for value in values]
+        offsets = array('q', [0])
+        for value in encoded:
+            offsets.append(offsets[-1] + len(value))
+        return offsets.tobytes(), b''.join(encoded)
+
+    imageTable = {}
+    imageIndex = array('q', (imageTable.setdefault(image, len(imageTable)) for image in snapshot.images))
+    positions = array('q')
+    byCategory = {}
+    for categoryId, members in snapshot._byCategory.items():
+        key = categoryId if categoryId is not None else 0
+        byCategory[key] = [len(positions), len(positions) + len(members)]
+        positions.extend(members)
+    sections = [
+        ('ids', array('q', snapshot.ids).tobytes()),
+        ('prices', array('d', snapshot.prices).tobytes()),
+        ('categoryIds', array('q', snapshot.categoryIds).tobytes()),
+        ('imageIndex', imageIndex.tobytes()),
+        ('categoryPositions', positions.tobytes()),
+        ('priceOrder', array('q', snapshot._priceOrder).tobytes()),
+        ('sortedPrices', array('d', snapshot._sortedPrices).tobytes()),
+        ('categoryTable', array('q', (categoryId for categoryId, name in snapshot.categories)).tobytes()),
+    ]
+    for name, values in (('names', snapshot.names), ('descriptions', snapshot.descriptions), ('images', list(imageTable)), ('categoryNames', [name for categoryId, name in snapshot.categories])):
+        offsets, data = strings(values)
+        sections.append((name + 'Offsets', offsets))
+        sections.append((name, data))
+
+    # 头部里记录每一段的位置；位置依赖头部长度，所以先按最长的数字估算一次
+    header = dict(meta, products=len(snapshot), byCategory=byCategory, sections={name: [0, len(data)] for name, data in sections})
+    start = HEADER.size + len(json.dumps(header).encode()) + 32 * len(sections) + 8
+    offset = start
+    for name, data in sections:
+        header['sections'][name] = [offset, len(data)]
+        # 每一段按8字节对齐，memoryview.cast 才能直接用
+        offset += (len(data) + 7) // 8 * 8
+    encoded = json.dumps(header).encode()
+    assert HEADER.size + len(encoded) <= start
+
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(encoded)))
+        f.write(encoded)
+        f.write(b'\0' * (start - HEADER.size - len(encoded)))
+        for name, data in sections:
+            f.write(data)
+            f.write(b'\0' * ((8 - len(data) % 8) % 8))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class Catalog:
+    """持有当前的目录快照；重建时先在旁边建好新快照，再一次性替换引用
+
+    给了 path 时，快照写到这个文件里再 mmap 使用，多个 worker 共用一份；
+    文件已经是最新的（目录版本和数据库都对得上）就直接映射，不再查商品表。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.snapshot = None
+        self.database = None
+        # 快照对应的 change_log 位置，比它旧的改动已经包含在快照里
+        self.changeId = 0
+        self._lock = threading.Lock()
+
+    def load(self, conn, database=None):
+        """从数据库重建快照并替换当前快照，返回新快照"""
+        with self._lock:
+            cur = conn.cursor()
+            # 在同一个读事务里取日志位置和数据，两者对应同一个时刻
+            ownTransaction = not conn.in_transaction
+            if ownTransaction:
+                cur.execute('BEGIN')
+            try:
+                try:
+                    cur.execute('SELECT coalesce(max(changeId), 0) FROM change_log')
+                    changeId = cur.fetchone()[0]
+                    # 目录版本只看商品和分类的改动，session 之类的改动不用重写文件
+                    cur.execute("SELECT coalesce(max(changeId), 0) FROM change_log WHERE tableName IN ('products', 'categories')")
+                    catalogVersion = cur.fetchone()[0]
+                except sqlite3.OperationalError:
+                    changeId = catalogVersion = None
+                snapshot = self._mapped(database, catalogVersion) if self.path else None
+                if snapshot is None:
+                    cur.execute('SELECT categoryId, name FROM categories')
+                    categories = cur.fetchall()
+                    # 没有价格的商品不能上架，也放不进 array('d')
+                    cur.execute('SELECT productId, name, price, description, image, categoryId FROM products WHERE price IS NOT NULL ORDER BY productId')
+                    snapshot = CatalogSnapshot(cur, categories)
+                    if self.path:
+                        writeSnapshot(snapshot, self.path, database=database, catalogVersion=catalogVersion)
+                        snapshot = MappedSnapshot(self.path)
+            finally:
+                if ownTransaction:
+                    conn.commit()
+            self.snapshot, self.database, self.changeId = snapshot, database, changeId or 0
+        return snapshot
+
+    def _mapped(self, database, catalogVersion):
+        """文件存在并且跟数据库的目录版本一致时直接映射，否则返回 None"""
+        # 没有变更日志时无法判断文件是否过期，每次都重写
+        if catalogVersion is None:
+            return None
+        try:
+            snapshot = MappedSnapshot(self.path)
+        except (OSError, ValueError):
+            return None
+        if snapshot.header.get('database') != database or snapshot.header.get('catalogVersion') != catalogVersion:
+            return None
+        return snapshot
+
+    def invalidate(self, changeId=None):
+        """丢掉比 changeId 旧的快照，下次使用时重新加载；changeId 为 None 时总是丢掉"""
+        with self._lock:
+            if changeId is None or changeId > self.changeId:
+                self.snapshot = None
+
+    def stats(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {'loaded': False}
+        return {
+            'loaded': True,
+            'products': len(snapshot),
+            'categories': len(snapshot.categories),
+            'bytes': snapshot.memoryUsage(),
+            'mapped': isinstance(snapshot, MappedSnapshot),
+        }
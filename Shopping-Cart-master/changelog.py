@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import threading
+
+import db
+
+# 变更日志最多保留的行数，多久清理一次（秒）
+KEEP_CHANGES = 10000
+PRUNE_INTERVAL = 60
+
+
+def origin():
+    """写入者标识；写 sessions 时记下来，自己进程的改动不用再处理一遍"""
+    return str(os.getpid())
+
+
+class ChangeWatcher:
+    """通过 change_log 表让每个进程的内存缓存跟数据库保持一致
+
+    products、categories、users、sessions 上的触发器把每次改动记到 change_log。
+    每个请求开始时先看一眼 PRAGMA data_version，只有其他连接提交过事务时才去读
+    新增的日志，按表把改动的主键交给订阅者，让它们只丢掉受影响的缓存条目。
+    旧日志由后台线程定期清理，请求里不做写操作。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.lastChangeId = None
+        self._handlers = {}
+        self._conn = None
+        self._database = None
+        self._dataVersion = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'checks': 0, 'reads': 0, 'changes': 0, 'flushes': 0, 'pruned': 0, 'errors': 0}
+
+    def subscribe(self, table, handler):
+        """handler(keys, changeId)：keys 是改动过的主键集合，None 表示全部作废"""
+        self._handlers.setdefault(table, []).append(handler)
+
+    def _connect(self, database):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = db.get_pool(self.app).acquire()
+        self._database = database
+        self._dataVersion = None
+        self.lastChangeId = None
+
+    def check(self):
+        """每个请求调用一次；没有新的提交时只执行一条 PRAGMA"""
+        database = self.app.config['DATABASE']
+        with self._lock:
+            self._stats['checks'] += 1
+            try:
+                if database != self._database:
+                    self._connect(database)
+                version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+                if version == self._dataVersion:
+                    return
+                self._stats['reads'] += 1
+                if self.lastChangeId is None:
+                    # 刚启动时缓存都是空的，从当前位置开始跟踪
+                    self.lastChangeId = self._conn.execute('SELECT coalesce(max(changeId), 0) FROM change_log').fetchone()[0]
+                    rows = []
+                else:
+                    rows = self._conn.execute('SELECT changeId, tableName, rowKey, origin FROM change_log WHERE changeId > ? ORDER BY changeId', (self.lastChangeId, )).fetchall()
+            except sqlite3.Error:
+                # 只读库或者还没迁移，没有 change_log 表；读失败时版本号不变，下个请求再读
+                return
+            if rows:
+                # 日志是连续编号的，中间缺了说明旧日志已经被清理，只能全部作废
+                self._dispatch(rows, rows[0][0] > self.lastChangeId + 1)
+                self.lastChangeId = rows[-1][0]
+            # 在锁里交给订阅者之后才记下版本号，其他线程不会在缓存作废之前跳过检查
+            self._dataVersion = version
+        self.start()
+
+    def _dispatch(self, rows, flush):
+        changeId = rows[-1][0]
+        if flush:
+            self._stats['flushes'] += 1
+            for handlers in self._handlers.values():
+                for handler in handlers:
+                    handler(None, changeId)
+            return
+        me = origin()
+        changed = {}
+        for _, table, key, writer in rows:
+            if writer != me:
+                changed.setdefault(table, set()).add(key)
+        self._stats['changes'] += len(rows)
+        for table, keys in changed.items():
+            # 批量导入只记一行 '*'，表示整张表都变了
+            if '*' in keys:
+                keys = None
+            for handler in self._handlers.get(table, ()):
+                handler(keys, changeId)
+
+    def start(self):
+        """启动清理旧日志的后台线程"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='change-log-pruner', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def prune(self):
+        """只保留最近 KEEP_CHANGES 条日志，返回删除的行数"""
+        pool = db.get_pool(self.app)
+        conn = pool.acquire()
+        try:
+            with conn:
+                cur = conn.execute('DELETE FROM change_log WHERE changeId <= (SELECT max(changeId) FROM change_log) - ?', (KEEP_CHANGES, ))
+        finally:
+            pool.release(conn)
+        self._stats['pruned'] += cur.rowcount
+        return cur.rowcount
+
+    def _run(self):
+        # 批量导入持有写锁时 DELETE 会等 busy_timeout，在这里等不会拖慢请求
+        while not self._stop.wait(PRUNE_INTERVAL):
+            try:
+                self.prune()
+            except sqlite3.Error:
+                # 只读库或者数据库忙，下个周期再试
+                self._stats['errors'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['lastChangeId'] = self.lastChangeId
+            stats['dataVersion'] = self._dataVersion
+            stats['pruning'] = self._thread is not None
+        stats['tables'] = sorted(self._handlers)
+        return stats
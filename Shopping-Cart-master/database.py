@@ -1,11 +1,14 @@
+import os
 import sqlite3
+import sys
 
-#Open database
-conn = sqlite3.connect('database.db')
-
-#Create table
-conn.execute('''CREATE TABLE users 
-		(userId INTEGER PRIMARY KEY, 
+# 每个迁移对应一个 PRAGMA user_version，按顺序执行且只执行一次。
+# 每条语句单独放在一个短事务里，WAL模式下读请求不会被阻塞，
+# 写锁也只在建一个索引的时间内持有。
+MIGRATIONS = [
+    # 1: 初始表结构（已有数据库可以安全重跑）
+    ['''CREATE TABLE IF NOT EXISTS users
+		(userId INTEGER PRIMARY KEY,
 		password TEXT,
 		email TEXT,
 		firstName TEXT,
@@ -15,11 +18,10 @@ conn.execute('''CREATE TABLE users
 		zipcode TEXT,
 		city TEXT,
 		state TEXT,
-		country TEXT, 
+		country TEXT,
 		phone TEXT
-		)''')
-
-conn.execute('''CREATE TABLE products
+		)''',
+    '''CREATE TABLE IF NOT EXISTS products
 		(productId INTEGER PRIMARY KEY,
 		name TEXT,
 		price REAL,
@@ -28,21 +30,345 @@ conn.execute('''CREATE TABLE products
 		stock INTEGER,
 		categoryId INTEGER,
 		FOREIGN KEY(categoryId) REFERENCES categories(categoryId)
-		)''')
-
-conn.execute('''CREATE TABLE kart
+		)''',
+    '''CREATE TABLE IF NOT EXISTS kart
 		(userId INTEGER,
 		productId INTEGER,
 		FOREIGN KEY(userId) REFERENCES users(userId),
 		FOREIGN KEY(productId) REFERENCES products(productId)
-		)''')
-
-conn.execute('''CREATE TABLE categories
+		)''',
+    '''CREATE TABLE IF NOT EXISTS categories
 		(categoryId INTEGER PRIMARY KEY,
 		name TEXT
-		)''')
+		)'''],
+    # 2: 登录、购物车和分类页面用到的索引
+    # users.email 暂不加 UNIQUE：现有数据里有重复注册的邮箱，/register 也允许重复
+    ['CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)',
+    'CREATE INDEX IF NOT EXISTS idx_kart_user_product ON kart(userId, productId)',
+    'CREATE INDEX IF NOT EXISTS idx_kart_product ON kart(productId)',
+    'CREATE INDEX IF NOT EXISTS idx_products_category ON products(categoryId, productId)',
+    'ANALYZE'],
+    # 3: 商品全文搜索（external content FTS5，触发器保持同步）
+    ['''CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5
+		(name,
+		description,
+		content='products',
+		content_rowid='productId'
+		)''',
+    '''CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+		INSERT INTO products_fts (rowid, name, description) VALUES (new.productId, new.name, new.description);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+		INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.productId, old.name, old.description);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+		INSERT INTO products_fts (products_fts, rowid, name, description) VALUES ('delete', old.productId, old.name, old.description);
+		INSERT INTO products_fts (rowid, name, description) VALUES (new.productId, new.name, new.description);
+		END''',
+    "INSERT INTO products_fts (products_fts) VALUES ('rebuild')"],
+    # 4: 购物车每个商品一行，带数量；把原来重复的行合并成数量
+    [lambda conn: rebuildKart(conn),
+    'ANALYZE kart'],
+    # 5: 订单；order_items 保存下单时的名称和价格，商品删除后历史订单不受影响
+    ['''CREATE TABLE IF NOT EXISTS orders
+		(orderId INTEGER PRIMARY KEY,
+		userId INTEGER NOT NULL,
+		createdAt INTEGER NOT NULL,
+		total REAL NOT NULL,
+		FOREIGN KEY(userId) REFERENCES users(userId)
+		)''',
+    '''CREATE TABLE IF NOT EXISTS order_items
+		(orderId INTEGER NOT NULL,
+		productId INTEGER NOT NULL,
+		name TEXT,
+		price REAL NOT NULL,
+		quantity INTEGER NOT NULL,
+		PRIMARY KEY (orderId, productId),
+		FOREIGN KEY(orderId) REFERENCES orders(orderId)
+		) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(userId, orderId)'],
+    # 6: 加入购物车时的库存预留；products.stock 是扣掉预留之后的可用库存
+    ['''CREATE TABLE IF NOT EXISTS reservations
+		(userId INTEGER NOT NULL,
+		productId INTEGER NOT NULL,
+		quantity INTEGER NOT NULL,
+		expiresAt INTEGER NOT NULL,
+		PRIMARY KEY (userId, productId),
+		FOREIGN KEY(userId) REFERENCES users(userId),
+		FOREIGN KEY(productId) REFERENCES products(productId)
+		) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_reservations_expires ON reservations(expiresAt)'],
+    # 7: 服务端session，cookie里只保存 sid
+    ['''CREATE TABLE IF NOT EXISTS sessions
+		(sid TEXT PRIMARY KEY,
+		data TEXT NOT NULL,
+		expiresAt INTEGER NOT NULL
+		) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions(expiresAt)'],
+    # 8: 变更日志，多个进程据此让各自的内存缓存失效
+    #    origin 是写入者的进程号（只有 sessions 会填），自己的改动不用再处理
+    # 整个迁移放在一个事务里
+    [['''CREATE TABLE IF NOT EXISTS change_log
+		(changeId INTEGER PRIMARY KEY,
+		tableName TEXT NOT NULL,
+		rowKey NOT NULL,
+		origin TEXT
+		)''',
+    lambda conn: addColumn(conn, 'sessions', 'writer', 'TEXT'),
+    # 库存不在任何缓存里，只有目录上展示的列改了才记日志
+    '''CREATE TRIGGER IF NOT EXISTS products_log_insert AFTER INSERT ON products BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('products', new.productId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS products_log_update AFTER UPDATE OF productId, name, price, description, image, categoryId ON products BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('products', old.productId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS products_log_delete AFTER DELETE ON products BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('products', old.productId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS categories_log_insert AFTER INSERT ON categories BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('categories', new.categoryId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS categories_log_update AFTER UPDATE ON categories BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('categories', old.categoryId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS categories_log_delete AFTER DELETE ON categories BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('categories', old.categoryId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_log_update AFTER UPDATE OF email, firstName, password ON users BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('users', old.userId);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_log_delete AFTER DELETE ON users BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('users', old.userId);
+		END''',
+    # 新的 sid 不会在任何进程的缓存里，只记录更新和删除；删除不记 origin，所有进程都要丢掉
+    '''CREATE TRIGGER IF NOT EXISTS sessions_log_update AFTER UPDATE ON sessions BEGIN
+		INSERT INTO change_log (tableName, rowKey, origin) VALUES ('sessions', old.sid, new.writer);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS sessions_log_delete AFTER DELETE ON sessions BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('sessions', old.sid);
+		END''']],
+    # 9: 分类页按价格/库存筛选用的覆盖索引，以及触发器维护的分类商品数
+    #    (categoryId, price) 里同价格的行按 rowid 排列，ORDER BY price, productId 不需要额外排序
+    ['CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(categoryId, price)',
+    'CREATE INDEX IF NOT EXISTS idx_products_category_stock ON products(categoryId, stock)',
+    ['''CREATE TABLE IF NOT EXISTS category_counts
+		(categoryId INTEGER PRIMARY KEY,
+		products INTEGER NOT NULL DEFAULT 0
+		)''',
+    '''INSERT OR REPLACE INTO category_counts (categoryId, products)
+		SELECT categoryId, count(*) FROM products WHERE categoryId IS NOT NULL GROUP BY categoryId''',
+    '''CREATE TRIGGER IF NOT EXISTS category_counts_insert AFTER INSERT ON products BEGIN
+		INSERT INTO category_counts (categoryId, products) VALUES (new.categoryId, 1)
+			ON CONFLICT (categoryId) DO UPDATE SET products = products + 1;
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS category_counts_delete AFTER DELETE ON products BEGIN
+		UPDATE category_counts SET products = products - 1 WHERE categoryId = old.categoryId;
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS category_counts_update AFTER UPDATE OF categoryId ON products
+		WHEN old.categoryId IS NOT new.categoryId BEGIN
+		UPDATE category_counts SET products = products - 1 WHERE categoryId = old.categoryId;
+		INSERT INTO category_counts (categoryId, products) VALUES (new.categoryId, 1)
+			ON CONFLICT (categoryId) DO UPDATE SET products = products + 1;
+		END'''],
+    'ANALYZE products'],
+    # 10: 批量导入的进度，和导入的数据在同一个事务里提交，失败后可以接着导入
+    ['''CREATE TABLE IF NOT EXISTS import_progress
+		(source TEXT PRIMARY KEY,
+		size INTEGER NOT NULL,
+		rowsDone INTEGER NOT NULL,
+		updatedAt INTEGER NOT NULL
+		)'''],
+    # 11: 上传图片的缩略图，每张图每个尺寸、格式一行；商品通过 products.image 找到自己的缩略图
+    [['''CREATE TABLE IF NOT EXISTS image_variants
+		(image TEXT NOT NULL,
+		size TEXT NOT NULL,
+		format TEXT NOT NULL,
+		width INTEGER NOT NULL,
+		height INTEGER NOT NULL,
+		file TEXT NOT NULL,
+		PRIMARY KEY (image, size, format)
+		) WITHOUT ROWID''',
+    '''CREATE TRIGGER IF NOT EXISTS image_variants_log_insert AFTER INSERT ON image_variants BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('image_variants', new.image);
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS image_variants_log_delete AFTER DELETE ON image_variants BEGIN
+		INSERT INTO change_log (tableName, rowKey) VALUES ('image_variants', old.image);
+		END''']],
+    # 12: 同一个进程连续保存同一个session不再记日志，只有换了写入者才记。
+    #     各进程只缓存自己最后写入的session，所以别的进程不会有过期的副本
+    [['DROP TRIGGER IF EXISTS sessions_log_update',
+    '''CREATE TRIGGER IF NOT EXISTS sessions_log_update AFTER UPDATE ON sessions
+		WHEN old.writer IS NOT new.writer BEGIN
+		INSERT INTO change_log (tableName, rowKey, origin) VALUES ('sessions', old.sid, new.writer);
+		END''']],
+    # 13: 没有分类的商品不计数。categoryId 是 INTEGER PRIMARY KEY，插入 NULL 会分到一个新的 id，
+    #     多出来的行会算到以后用这个 id 建的分类上；重建触发器后重新统计一遍
+    [['DROP TRIGGER IF EXISTS category_counts_insert',
+    'DROP TRIGGER IF EXISTS category_counts_update',
+    '''CREATE TRIGGER IF NOT EXISTS category_counts_insert AFTER INSERT ON products
+		WHEN new.categoryId IS NOT NULL BEGIN
+		INSERT INTO category_counts (categoryId, products) VALUES (new.categoryId, 1)
+			ON CONFLICT (categoryId) DO UPDATE SET products = products + 1;
+		END''',
+    '''CREATE TRIGGER IF NOT EXISTS category_counts_update AFTER UPDATE OF categoryId ON products
+		WHEN old.categoryId IS NOT new.categoryId BEGIN
+		UPDATE category_counts SET products = products - 1 WHERE categoryId = old.categoryId;
+		INSERT INTO category_counts (categoryId, products) SELECT new.categoryId, 1 WHERE new.categoryId IS NOT NULL
+			ON CONFLICT (categoryId) DO UPDATE SET products = products + 1;
+		END''',
+    'DELETE FROM category_counts',
+    '''INSERT INTO category_counts (categoryId, products)
+		SELECT categoryId, count(*) FROM products WHERE categoryId IS NOT NULL GROUP BY categoryId''']],
+]
+
+# main.py 中的查询，用于 --explain 报告
+QUERIES = [
+    ("SELECT userId, firstName FROM users WHERE email = ?", ('sample@example.com', )),
+    ("SELECT coalesce(sum(quantity), 0) FROM kart WHERE userId = ?", (1, )),
+    ("SELECT productId, stock FROM products", ()),
+    ("SELECT productId, name, price, description, image, categoryId FROM products ORDER BY productId", ()),
+    ("SELECT categoryId, name FROM categories", ()),
+    ("SELECT userId, email, firstName, lastName, address1, address2, zipcode, city, state, country, phone FROM users WHERE email = ?", ('sample@example.com', )),
+    ("SELECT userId, password FROM users WHERE email = ?", ('sample@example.com', )),
+    ("SELECT productId, name, price, description, image, stock FROM products WHERE productId = ?", (1, )),
+    ("SELECT userId FROM users WHERE email = ?", ('sample@example.com', )),
+    ("SELECT products.productId, products.name, products.price, products.image, kart.quantity, products.price * kart.quantity, sum(products.price * kart.quantity) OVER () FROM kart JOIN products ON products.productId = kart.productId WHERE kart.userId = ?", (1, )),
+    ("INSERT INTO kart (userId, productId, quantity) VALUES (?, ?, 1) ON CONFLICT (userId, productId) DO UPDATE SET quantity = quantity + 1", (1, 1)),
+    ("DELETE FROM kart WHERE userId = ? AND productId = ? RETURNING quantity", (1, 1)),
+    ("SELECT password FROM users WHERE email = ?", ('sample@example.com', )),
+    ("SELECT productId, name, price, image FROM products WHERE productId > ? ORDER BY productId LIMIT ?", (0, 29)),
+    ("UPDATE products SET stock = stock - ? WHERE productId = ? AND stock >= ?", (1, 1, 1)),
+    ("SELECT orderId, createdAt, total FROM orders WHERE userId = ? AND orderId < ? ORDER BY orderId DESC LIMIT ?", (1, 100, 11)),
+    ("SELECT userId, productId FROM reservations WHERE expiresAt <= ? LIMIT ?", (0, 500)),
+    ("SELECT stock FROM products WHERE productId = ?", (1, )),
+    ("SELECT expiresAt, data FROM sessions WHERE sid = ?", ('sid', )),
+    ("SELECT changeId, tableName, rowKey, origin FROM change_log WHERE changeId > ? ORDER BY changeId", (0, )),
+    ("SELECT categoryId, products FROM category_counts", ()),
+    ("SELECT productId FROM products WHERE categoryId = ? AND price >= ? AND price <= ? AND stock > 0 ORDER BY price, productId LIMIT ? OFFSET ?", (1, 0, 100, 29, 0)),
+    ("SELECT productId FROM products WHERE categoryId = ? AND stock > 0 ORDER BY productId DESC LIMIT ? OFFSET ?", (1, 29, 0)),
+    ("SELECT productId FROM products WHERE categoryId = ? ORDER BY productId LIMIT ? OFFSET ?", (1, 29, 0)),
+    ("DELETE FROM sessions WHERE sid IN (SELECT sid FROM sessions WHERE expiresAt <= ? LIMIT ?)", (0, 500)),
+    ("SELECT products.productId, products.name, products.price, products.image FROM products_fts JOIN products ON products.productId = products_fts.rowid WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT ? OFFSET ?", ('"book"*', 29, 0)),
+]
+
+
+class SchemaError(RuntimeError):
+    """数据库的结构版本比代码旧，又不能在这里升级"""
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def columns(conn, table):
+    return [row[1] for row in conn.execute('PRAGMA table_info({})'.format(table))]
+
+
+def addColumn(conn, table, column, definition):
+    # ALTER TABLE ADD COLUMN 没有 IF NOT EXISTS
+    if column not in columns(conn, table):
+        conn.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table, column, definition))
+
+
+def rebuildKart(conn):
+    # 已经有 quantity 列说明合并过了，再合并一次会把数量变成1
+    if 'quantity' in columns(conn, 'kart'):
+        return
+    for statement in ('''CREATE TABLE kart_new
+		(userId INTEGER NOT NULL,
+		productId INTEGER NOT NULL,
+		quantity INTEGER NOT NULL DEFAULT 1,
+		PRIMARY KEY (userId, productId),
+		FOREIGN KEY(userId) REFERENCES users(userId),
+		FOREIGN KEY(productId) REFERENCES products(productId)
+		) WITHOUT ROWID''',
+            '''INSERT INTO kart_new (userId, productId, quantity)
+		SELECT userId, productId, count(*) FROM kart
+		WHERE userId IS NOT NULL AND productId IS NOT NULL
+		GROUP BY userId, productId''',
+            'DROP TABLE kart',
+            'ALTER TABLE kart_new RENAME TO kart',
+            'CREATE INDEX IF NOT EXISTS idx_kart_product ON kart(productId)'):
+        conn.execute(statement)
+
+
+def migrate(conn, target=None):
+    """把数据库升级到 target 版本（默认最新），返回升级后的版本
+
+    多个进程可能同时升级同一个库：每个事务拿到写锁后重新读 user_version，
+    别的进程已经做完的迁移直接跳过。一个迁移的前几个步骤可能被执行两次，
+    所以每个步骤都要能重复执行。
+    """
+    target = len(MIGRATIONS) if target is None else target
+    # 限制 ANALYZE 每个索引的采样行数，大表上也能很快完成
+    conn.execute('PRAGMA analysis_limit = 1000')
+    version = get_version(conn)
+    while version < target:
+        steps = MIGRATIONS[version]
+        for i, step in enumerate(steps):
+            # 一个步骤可以是一条语句、需要在同一事务里执行的一组语句，或者一个函数
+            statements = [step] if isinstance(step, str) or callable(step) else step
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if get_version(conn) != version:
+                    # 其他进程已经完成了这个迁移
+                    conn.rollback()
+                    break
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                if i == len(steps) - 1:
+                    conn.execute('PRAGMA user_version = {}'.format(version + 1))
+            except:
+                conn.rollback()
+                raise
+            conn.commit()
+        version = get_version(conn)
+    return version
+
+
+def require_version(conn):
+    """只读或者关闭了自动迁移时检查库是不是最新的，不是就报错，免得请求里才缺表"""
+    version = get_version(conn)
+    if version < len(MIGRATIONS):
+        raise SchemaError('database is at schema version {}, the app needs {}; run "python database.py" on it first'.format(version, len(MIGRATIONS)))
+    return version
+
+
+def explain(conn):
+    plans = []
+    for query, args in QUERIES:
+        try:
+            rows = conn.execute('EXPLAIN QUERY PLAN ' + query, args).fetchall()
+        except sqlite3.OperationalError as e:
+            # 还没迁移到的表
+            plans.append((query, ['-- ' + str(e)]))
+            continue
+        plans.append((query, [row[3] for row in rows]))
+    return plans
 
 
+def print_plans(plans):
+    for query, details in plans:
+        print(query)
+        for detail in details:
+            print('    ' + detail)
 
-conn.close()
 
+if __name__ == '__main__':
+    path = os.environ.get('DATABASE', 'database.db')
+    conn = sqlite3.connect(path, uri=path.startswith('file:'), isolation_level=None)
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA busy_timeout = 5000')
+    if '--explain' in sys.argv:
+        # 在升级前后分别输出查询计划
+        print('-- before (version {})'.format(get_version(conn)))
+        print_plans(explain(conn))
+        migrate(conn)
+        print('-- after (version {})'.format(get_version(conn)))
+        print_plans(explain(conn))
+    else:
+        print('database at version {}'.format(migrate(conn)))
+    conn.close()
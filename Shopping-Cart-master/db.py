@@ -0,0 +1,203 @@
+import os
+import queue
+import sqlite3
+import threading
+
+from flask import current_app, g
+
+import database as schema
+
+DATABASE = 'database.db'
+POOL_SIZE = 8
+
+# 数据库可以是文件路径，也可以是SQLite URI，例如：
+#   /dev/shm/shop.db
+#   file::memory:?cache=shared      （共享内存库，可用DATABASE_SEED从文件预载数据）
+#   file:database.db?mode=ro        （只读）
+
+# 每个连接只在创建时设置一次
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),      # 负数表示KiB，约16MB页缓存
+    ('mmap_size', 268435456),    # 256MB
+    ('busy_timeout', 5000),      # 毫秒
+)
+
+
+class ConnectionPool:
+    """线程安全的SQLite连接池，连接在请求之间复用"""
+
+    def __init__(self, database, max_size=POOL_SIZE, seed=None):
+        self.database = database
+        self.uri = database.startswith('file:')
+        self.max_size = max_size
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'reused': 0,
+            'in_use': 0,
+            'returned': 0,
+            'discarded': 0,
+        }
+        # 共享内存库在最后一个连接关闭时就会消失，所以池自己保留一个连接
+        self._keeper = None
+        if is_memory(database):
+            self._keeper = sqlite3.connect(database, uri=self.uri, check_same_thread=False)
+            if seed:
+                source = sqlite3.connect(seed)
+                source.backup(self._keeper)
+                source.close()
+
+    def _count(self, key, delta=1):
+        with self._lock:
+            self._stats[key] += delta
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, uri=self.uri, check_same_thread=False)
+        for name, value in PRAGMAS:
+            try:
+                conn.execute('PRAGMA {} = {}'.format(name, value))
+            except sqlite3.OperationalError:
+                # 只读库无法切换到WAL，保持原有的journal模式
+                pass
+        self._count('created')
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            self._count('reused')
+        except queue.Empty:
+            conn = self._connect()
+        self._count('in_use')
+        return conn
+
+    def release(self, conn):
+        self._count('in_use', -1)
+        # 不把未结束的事务带给下一个请求
+        if conn.in_transaction:
+            conn.rollback()
+        if self._idle.qsize() < self.max_size:
+            self._idle.put(conn)
+            self._count('returned')
+        else:
+            conn.close()
+            self._count('discarded')
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self._keeper is not None:
+            self._keeper.close()
+            self._keeper = None
+
+    def migrate(self):
+        conn = self.acquire()
+        try:
+            schema.migrate(conn)
+        finally:
+            self.release(conn)
+
+    def require_version(self):
+        conn = self.acquire()
+        try:
+            schema.require_version(conn)
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['idle'] = self._idle.qsize()
+        stats['max_size'] = self.max_size
+        stats['database'] = self.database
+        return stats
+
+
+def is_memory(database):
+    return database == ':memory:' or database.startswith('file::memory:') or 'mode=memory' in database
+
+
+def get_pool(app=None):
+    app = app or current_app
+    database = app.config['DATABASE']
+    pool = app.extensions.get('sqlite_pool')
+    # 配置在运行时被修改（例如测试夹具）时重建连接池
+    if pool is None or pool.database != database:
+        if pool is not None:
+            pool.close()
+        pool = ConnectionPool(database, app.config['DATABASE_POOL_SIZE'], app.config['DATABASE_SEED'])
+        try:
+            if app.config['DATABASE_MIGRATE'] and 'mode=ro' not in database:
+                pool.migrate()
+            else:
+                # 只读库不能迁移，必须事先用 python database.py 升级好
+                pool.require_version()
+        except:
+            pool.close()
+            raise
+        app.extensions['sqlite_pool'] = pool
+    return pool
+
+
+def get_db():
+    """返回当前请求的数据库连接，每个请求只从池中取一次"""
+    if 'db' not in g:
+        g.db = get_pool().acquire()
+        if current_app.config['SQL_COUNT']:
+            g.sqlCount = 0
+            g.db.set_trace_callback(count_statement)
+    return g.db
+
+
+def stream_rows(query, args=(), size=500):
+    """按块取查询结果的生成器，整个结果集不会同时放在内存里
+
+    流式响应在视图返回后才开始读，那时 get_db() 的连接已经还给连接池了，
+    所以自己借一个连接，读完或者客户端断开时归还。
+    """
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        cur = conn.execute(query, args)
+        while True:
+            rows = cur.fetchmany(size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        pool.release(conn)
+
+
+def count_statement(statement):
+    g.sqlCount += 1
+
+
+def add_sql_count(response):
+    # 调试用：在响应头里报告本次请求执行的SQL语句数
+    if current_app.config['SQL_COUNT']:
+        response.headers['X-SQL-Count'] = str(g.get('sqlCount', 0))
+    return response
+
+
+def close_db(e=None):
+    conn = g.pop('db', None)
+    if conn is not None:
+        conn.set_trace_callback(None)
+        get_pool().release(conn)
+
+
+def init_app(app):
+    # 优先使用app.config，其次是环境变量
+    app.config.setdefault('DATABASE', os.environ.get('DATABASE', DATABASE))
+    app.config.setdefault('DATABASE_POOL_SIZE', int(os.environ.get('DATABASE_POOL_SIZE', POOL_SIZE)))
+    app.config.setdefault('DATABASE_SEED', os.environ.get('DATABASE_SEED'))
+    app.config.setdefault('DATABASE_MIGRATE', os.environ.get('DATABASE_MIGRATE', '1') != '0')
+    app.config.setdefault('SQL_COUNT', os.environ.get('SQL_COUNT') == '1')
+    app.after_request(add_sql_count)
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,245 @@
+"""上传图片的处理：按内容哈希存原图，由进程池生成各个尺寸
+
+    python images.py    给还没有缩略图的商品图片补生成（数据库从 DATABASE 环境变量读取）
+"""
+import atexit
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import db
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # 没装 Pillow 时不生成缩略图，页面继续使用原图
+    Image = None
+
+# 每种尺寸的最长边（像素）。首页网格显示 150x200，商品页 200x250，购物车 80x100，按2倍屏准备
+SIZES = (('thumb', 200), ('grid', 400), ('detail', 1000))
+# (format, Pillow 编码器, 文件扩展名, 编码参数)
+FORMATS = (
+    ('webp', 'WEBP', 'webp', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+# 缩略图放在上传目录下的这个子目录里
+VARIANT_FOLDER = 'variants'
+CHUNK = 64 * 1024
+
+
+def processContext():
+    # 服务是多线程的，fork 出来的子进程会带上别的线程持有的锁；用 forkserver 从干净的进程派生
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def available():
+    return Image is not None
+
+
+def store(upload, folder, extension):
+    """把上传的文件按内容哈希存放，返回文件名；同样内容的文件只存一份"""
+    digest = hashlib.sha256()
+    fd, temp = tempfile.mkstemp(dir=folder, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: upload.stream.read(CHUNK), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        filename = '{}.{}'.format(digest.hexdigest()[:32], extension)
+        path = os.path.join(folder, filename)
+        if os.path.exists(path):
+            os.unlink(temp)
+        else:
+            os.replace(temp, path)
+    except:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+    return filename
+
+
+def flatten(image):
+    # JPEG 没有透明通道，透明的部分铺成白色
+    if image.mode == 'RGB':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def makeVariants(source, folder):
+    """在进程池里运行：生成所有尺寸和格式，返回 [(size, format, width, height, file)]"""
+    name = os.path.basename(source)
+    variants = []
+    with Image.open(source) as original:
+        # GIF 只取第一帧；按 EXIF 方向摆正
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+        for size, edge in SIZES:
+            resized = image.copy()
+            # 只缩小不放大，原图比这个尺寸小时就是原尺寸
+            resized.thumbnail((edge, edge), Image.LANCZOS)
+            for format, encoder, extension, options in FORMATS:
+                file = '{}.{}.{}'.format(name, size, extension)
+                temp = os.path.join(folder, file + '.part')
+                (resized if format == 'webp' else flatten(resized)).save(temp, encoder, **options)
+                os.replace(temp, os.path.join(folder, file))
+                variants.append((size, format, resized.width, resized.height, file))
+    return variants
+
+
+def record(conn, image, variants):
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO image_variants (image, size, format, width, height, file) VALUES (?, ?, ?, ?, ?, ?)', [(image, ) + variant for variant in variants])
+
+
+class ImagePipeline:
+    """把生成缩略图的工作交给进程池，上传请求不用等
+
+    完成后在回调线程里把各个尺寸记到 image_variants 表；表上的触发器写 change_log，
+    各个进程据此刷新缩略图索引和页面缓存。同一张图正在处理时不会重复提交。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'deduped': 0, 'done': 0, 'errors': 0}
+        # 退出时等进程池里的任务做完并回收子进程
+        atexit.register(self.stop)
+
+    def folder(self):
+        return os.path.join(self.app.root_path, self.app.config['UPLOAD_FOLDER'])
+
+    def submit(self, image):
+        """返回是否交给了进程池"""
+        if not available() or self.app.config['IMAGE_WORKERS'] <= 0:
+            return False
+        with self._lock:
+            if image in self._pending:
+                self._stats['deduped'] += 1
+                return False
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.app.config['IMAGE_WORKERS'], mp_context=processContext())
+            self._pending.add(image)
+            self._stats['submitted'] += 1
+        output = os.path.join(self.folder(), VARIANT_FOLDER)
+        os.makedirs(output, exist_ok=True)
+        future = self._executor.submit(makeVariants, os.path.join(self.folder(), image), output)
+        future.add_done_callback(lambda future: self._finished(image, future))
+        return True
+
+    def _finished(self, image, future):
+        try:
+            variants = future.result()
+            pool = db.get_pool(self.app)
+            conn = pool.acquire()
+            try:
+                record(conn, image, variants)
+            finally:
+                pool.release(conn)
+            self._stats['done'] += 1
+        except Exception:
+            # 图片损坏或数据库忙；页面继续使用原图
+            self._stats['errors'] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(image)
+
+    def stop(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['workers'] = self.app.config['IMAGE_WORKERS'] if available() else 0
+        return stats
+
+
+class VariantIndex:
+    """image -> 各格式按宽度排好的缩略图，渲染页面时查询
+
+    image_variants 只有几行一张图，整张表放在内存里；有改动时整个作废，下次用到再读。
+    """
+
+    def __init__(self):
+        self.database = None
+        self._variants = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._variants is not None
+
+    def load(self, conn, database=None):
+        variants = {}
+        try:
+            rows = conn.execute('SELECT image, size, format, width, file FROM image_variants ORDER BY image, format, width').fetchall()
+        except sqlite3.OperationalError:
+            # 还没迁移
+            rows = []
+        for image, size, format, width, file in rows:
+            entry = variants.setdefault(image, {'sizes': {}})
+            widths = entry.setdefault(format, [])
+            # 原图比较小时几个尺寸一样大，srcset 里只保留一个
+            if not widths or widths[-1][0] != width:
+                widths.append((width, file))
+            entry['sizes'].setdefault(format, {})[size] = file
+        with self._lock:
+            self._variants = variants
+            self.database = database
+        return variants
+
+    def get(self, image):
+        """{'webp': [(width, file)], 'jpeg': [...], 'sizes': {format: {size: file}}}，没有缩略图时为 None"""
+        variants = self._variants
+        return variants.get(image) if variants is not None else None
+
+    def invalidate(self):
+        with self._lock:
+            self._variants = None
+
+    def __len__(self):
+        return len(self._variants or ())
+
+
+def backfill(conn, folder, workers=None):
+    """给 products 里还没有缩略图的图片生成缩略图，返回处理的图片数"""
+    images = [image for image, in conn.execute('SELECT DISTINCT image FROM products WHERE image IS NOT NULL AND image NOT IN (SELECT image FROM image_variants)')]
+    images = [image for image in images if os.path.isfile(os.path.join(folder, image))]
+    output = os.path.join(folder, VARIANT_FOLDER)
+    os.makedirs(output, exist_ok=True)
+    done = 0
+    with ProcessPoolExecutor(workers, mp_context=processContext()) as executor:
+        futures = {image: executor.submit(makeVariants, os.path.join(folder, image), output) for image in images}
+        for image, future in futures.items():
+            try:
+                record(conn, image, future.result())
+                done += 1
+            except Exception as e:
+                print('{}: {}'.format(image, e), file=sys.stderr)
+    return done
+
+
+if __name__ == '__main__':
+    if not available():
+        sys.exit('Pillow is not installed')
+    import database as schema
+    path = os.environ.get('DATABASE', 'database.db')
+    conn = sqlite3.connect(path, uri=path.startswith('file:'))
+    conn.execute('PRAGMA busy_timeout = 5000')
+    schema.migrate(conn)
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+    print('generated variants for {} images'.format(backfill(conn, folder)))
+    conn.close()
@@ -1,12 +1,84 @@
 from flask import *
-import sqlite3, hashlib, os
-from werkzeug.utils import secure_filename
+import hashlib, hmac, json, math, os, re, time
+from itertools import islice
+from urllib.parse import parse_qs
+import db
+from db import get_db
+import images
+from assets import AssetManifest
+import reservations
+from autocomplete import PrefixIndex
+from catalog import Catalog
+from changelog import ChangeWatcher
+from pagecache import PageCache, makeEtag
+from sessionstore import ServerSessionInterface
+from functools import wraps
+from markupsafe import escape
 
 app = Flask(__name__)
 app.secret_key = 'random string'
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = set(['jpeg', 'jpg', 'png', 'gif'])
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# session里缓存的购物车数量多久后回数据库校对一次（秒）
+app.config['CART_COUNT_TTL'] = 60
+# 首页每页显示的商品数（每行7个）
+app.config['PAGE_SIZE'] = 28
+# 分类页和搜索结果最多翻到第几页，页码再大 OFFSET 会超出 SQLite 的整数范围
+app.config['MAX_PAGE'] = 10000
+# 页面缓存的字节预算
+app.config['PAGE_CACHE_BYTES'] = 8 * 1024 * 1024
+# 批量购物车接口一次最多接受的操作数
+app.config['CART_BATCH_LIMIT'] = 100
+# 批量接口里单个商品一次最多加/设置的数量
+app.config['CART_MAX_QUANTITY'] = 999
+# 游客购物车存在cookie里，限制行数和单行数量让cookie保持很小
+app.config['GUEST_CART_LIMIT'] = 20
+app.config['GUEST_CART_MAX_QUANTITY'] = 99
+# 订单历史每页显示的订单数
+app.config['ORDERS_PAGE_SIZE'] = 10
+# 加入购物车时预留库存，预留多久后过期（秒）
+app.config['RESERVATION_TTL'] = 15 * 60
+# 后台线程每隔多久清理一次过期预留（秒，0表示不启动），每轮最多处理的行数
+app.config['RESERVATION_SWEEP_INTERVAL'] = 5
+app.config['RESERVATION_SWEEP_BATCH'] = 500
+# session存在服务端（server，cookie里只有sid）还是Flask默认的签名cookie（cookie）
+app.config['SESSION_BACKEND'] = os.environ.get('SESSION_BACKEND', 'server')
+# 服务端session在进程内缓存的条数
+app.config['SESSION_CACHE_SIZE'] = 10000
+# 目录快照写到这个文件里再mmap，多个worker共用一份；不设置时每个进程各自保存一份
+app.config['CATALOG_MMAP'] = os.environ.get('CATALOG_MMAP')
+# 长列表页面边渲染边发送（0表示渲染完整个页面再发送），每攒够多少字节发送一次
+app.config['STREAM_PAGES'] = os.environ.get('STREAM_PAGES', '1') != '0'
+app.config['STREAM_BUFFER'] = 16 * 1024
+# 生成缩略图的进程数（0表示不生成，页面使用原图）
+app.config['IMAGE_WORKERS'] = 2
+db.init_app(app)
+# 多个worker进程时，靠 change_log 让各自的内存缓存失效
+changes = ChangeWatcher(app)
+# 只读库写不了 sessions 表，自动改用cookie session
+if app.config['SESSION_BACKEND'] == 'server' and 'mode=ro' not in app.config['DATABASE']:
+    app.session_interface = ServerSessionInterface(app.config['SESSION_CACHE_SIZE'], changes)
+# 搜索框输入联想用的内存索引
+suggestions = PrefixIndex()
+# 进程内的商品目录快照，目录页面直接从这里读
+catalog = Catalog(app.config['CATALOG_MMAP'])
+# 目录页面的渲染结果缓存
+pageCache = PageCache(app.config['PAGE_CACHE_BYTES'])
+# 把过期预留还给库存的后台线程
+sweeper = reservations.ReservationSweeper(app)
+# 上传图片交给进程池生成缩略图；已经生成的缩略图按图片文件名索引
+imagePipeline = images.ImagePipeline(app)
+variantIndex = images.VariantIndex()
+# 静态文件的内容哈希清单，url_for('static') 生成带哈希、可以长期缓存的地址
+assets = AssetManifest(app)
+# 登录用户共用的页面先用占位符渲染页头，返回前再替换成本人的数据
+FIRST_NAME_SLOT = '__FIRST_NAME_SLOT__'
+CART_COUNT_SLOT = '__CART_COUNT_SLOT__'
+# 商品页的库存随加入购物车变化，也在返回前才填入
+STOCK_SLOT = '__STOCK_SLOT__'
+# 其他进程改过的用户 userId -> changeId；key 为 None 表示所有用户
+userChanges = {}
 
 @app.route("/debug-auth")
 def debug_auth():
@@ -16,9 +88,18 @@ def debug_auth():
         'has_email': 'email' in session,
         'has_firstName': 'firstName' in session,
         'logged_in': session.get('logged_in', False),
-        'session_keys': list(session.keys())
+        'session_keys': list(session.keys()),
+        # memory / sqlite / new 表示服务端session从哪里读到的，cookie 表示默认的cookie session
+        'session_backend': getattr(session, 'backend', 'cookie')
     }
 
+@app.route("/debug-session-store")
+def debug_session_store():
+    """调试服务端session缓存"""
+    if not isinstance(app.session_interface, ServerSessionInterface):
+        return {'backend': 'cookie'}
+    return app.session_interface.store.stats()
+
 @app.route("/debug-headers")
 def debug_headers():
     """调试请求头"""
@@ -27,41 +108,360 @@ def debug_headers():
         'cookies': dict(request.cookies)
     }
 
-def getLoginDetails():
-    with sqlite3.connect('database.db') as conn:
+@app.route("/debug-pool")
+def debug_pool():
+    """调试数据库连接池"""
+    return db.get_pool().stats()
+
+@app.route("/debug-page-cache")
+def debug_page_cache():
+    """调试页面缓存"""
+    return pageCache.stats()
+
+@app.route("/debug-suggest")
+def debug_suggest():
+    """调试输入联想索引的大小"""
+    return suggestions.stats()
+
+@app.route("/debug-changes")
+def debug_changes():
+    """调试跨进程的缓存失效"""
+    return changes.stats()
+
+@app.route("/debug-catalog")
+def debug_catalog():
+    """调试目录快照的大小"""
+    return catalog.stats()
+
+@app.route("/debug-assets")
+def debug_assets():
+    """调试静态文件清单"""
+    return assets.stats()
+
+@app.route("/debug-images")
+def debug_images():
+    """调试缩略图生成"""
+    stats = imagePipeline.stats()
+    stats['indexed'] = len(variantIndex)
+    return stats
+
+@app.route("/debug-reservations")
+def debug_reservations():
+    """调试库存预留"""
+    with get_db() as conn:
         cur = conn.cursor()
-        if 'email' not in session:
-            loggedIn = False
-            firstName = ''
-            noOfItems = 0
+        cur.execute("SELECT count(*), coalesce(sum(quantity), 0), coalesce(sum(expiresAt <= ?), 0) FROM reservations", (int(time.time()), ))
+        holds, quantity, expired = cur.fetchone()
+    stats = sweeper.stats()
+    stats.update({'holds': holds, 'quantity': quantity, 'expired': expired})
+    return stats
+
+def getCurrentUser():
+    """当前请求的登录用户 (userId, firstName)，优先使用session里的缓存"""
+    if 'currentUser' not in g:
+        g.currentUser = None
+        if 'email' in session:
+            if 'userId' in session and 'firstName' in session and not userChanged(session['userId']):
+                g.currentUser = (session['userId'], session['firstName'])
+            else:
+                with get_db() as conn:
+                    cur = conn.cursor()
+                    cur.execute("SELECT userId, firstName FROM users WHERE email = ?", (session['email'], ))
+                    g.currentUser = cur.fetchone()
+                if g.currentUser is not None:
+                    session['userId'], session['firstName'] = g.currentUser
+                    session['userAt'] = changes.lastChangeId or 0
+    return g.currentUser
+
+def userChanged(userId):
+    # session里缓存的用户信息是不是比其他进程的改动旧
+    changedAt = max(userChanges.get(userId, 0), userChanges.get(None, 0))
+    return changedAt > session.get('userAt', 0)
+
+@app.context_processor
+def injectCurrentUser():
+    # 模板通过 currentUser() 按需取用，不会额外查询
+    return {'currentUser': getCurrentUser}
+
+def getLoginDetails():
+    user = getCurrentUser()
+    if user is None:
+        if g.get('sharedPage'):
+            return (False, '', CART_COUNT_SLOT)
+        # 游客的购物车只在session里
+        return (False, '', sum(loadGuestCart().values()))
+    if g.get('sharedPage'):
+        return (True, FIRST_NAME_SLOT, CART_COUNT_SLOT)
+    userId, firstName = user
+    # 购物车数量缓存缺失或过期时才查询数据库
+    if 'noOfItems' not in session or time.time() - session.get('noOfItemsAt', 0) > app.config['CART_COUNT_TTL']:
+        with get_db() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT coalesce(sum(quantity), 0) FROM kart WHERE userId = ?", (userId, ))
+            session['noOfItems'] = cur.fetchone()[0]
+        session['noOfItemsAt'] = int(time.time())
+    return (True, firstName, session['noOfItems'])
+
+def cachedPage(view=None, fill=None):
+    """目录页面的渲染缓存：匿名访问直接返回缓存，登录用户只替换页头，并支持条件请求
+
+    fill(body) 在返回前填入随时变化的内容，返回 (body, 参与ETag计算的值)。
+    """
+    if view is None:
+        return lambda view: cachedPage(view, fill)
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = getCurrentUser()
+        key = (request.endpoint, request.query_string, user is not None)
+        cached = pageCache.get(key)
+        if cached is None:
+            version = pageCache.version
+            g.sharedPage = True
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                g.sharedPage = False
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            if g.pop('uncacheable', False):
+                etag = makeEtag(body)
+            else:
+                etag = pageCache.put(key, version, body)
         else:
-            loggedIn = True
-            cur.execute("SELECT userId, firstName FROM users WHERE email = ?", (session['email'], ))
-            userId, firstName = cur.fetchone()
-            cur.execute("SELECT count(productId) FROM kart WHERE userId = ?", (userId, ))
-            noOfItems = cur.fetchone()[0]
-    conn.close()
-    return (loggedIn, firstName, noOfItems)
+            body, etag = cached
+        loggedIn, firstName, noOfItems = getLoginDetails()
+        body = body.replace(CART_COUNT_SLOT.encode(), str(noOfItems).encode())
+        if loggedIn:
+            body = body.replace(FIRST_NAME_SLOT.encode(), str(escape(firstName)).encode())
+        extra = ''
+        if fill is not None:
+            body, extra = fill(body)
+        # 页面只由缓存内容和页头数据决定，不用重新对整个页面做哈希
+        etag = makeEtag('{}|{}|{}|{}'.format(etag, firstName, noOfItems, extra).encode())
+        response = make_response(body)
+        response.set_etag(etag)
+        response.last_modified = int(pageCache.modified)
+        response.cache_control.no_cache = True
+        if user is not None:
+            response.cache_control.private = True
+        return response.make_conditional(request)
+    return wrapper
+
+def renderPage(template, **context):
+    """渲染长列表页面；context 里可以有游标生成器，流式渲染时边取行边发送"""
+    if not app.config['STREAM_PAGES']:
+        return render_template(template, **context)
+    # 模板里查缩略图可能要读数据库，先在请求里加载好
+    loadVariantIndex()
+    def chunks(parts, size):
+        # Jinja 每段输出都很短，攒成块再交给服务器写出去
+        buffer = []
+        length = 0
+        for part in parts:
+            buffer.append(part)
+            length += len(part)
+            if length >= size:
+                yield ''.join(buffer)
+                buffer = []
+                length = 0
+        if buffer:
+            yield ''.join(buffer)
+    return Response(chunks(stream_template(template, **context), app.config['STREAM_BUFFER']), mimetype='text/html')
+
+def getCatalog():
+    # 第一次使用或数据库换了时才从数据库加载
+    snapshot = catalog.snapshot
+    if snapshot is None or catalog.database != app.config['DATABASE']:
+        with get_db() as conn:
+            snapshot = catalog.load(conn, app.config['DATABASE'])
+    return snapshot
+
+def getCategoryData():
+    # 侧栏的分类和商品数；商品数由触发器维护在 category_counts 表里
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT categoryId, products FROM category_counts')
+        counts = dict(cur.fetchall())
+    return [(categoryId, name, counts.get(categoryId, 0)) for categoryId, name in getCatalog().categories]
+
+@app.template_global()
+def imageVariants(image):
+    """模板里查图片的缩略图，还没生成时返回 None"""
+    loadVariantIndex()
+    return variantIndex.get(image)
+
+def loadVariantIndex():
+    if not variantIndex.loaded or variantIndex.database != app.config['DATABASE']:
+        with get_db() as conn:
+            variantIndex.load(conn, app.config['DATABASE'])
+
+def catalogChanged():
+    # 商品增删后重建目录快照，缓存的目录页面全部作废
+    with get_db() as conn:
+        catalog.load(conn, app.config['DATABASE'])
+    pageCache.bump()
+
+@app.before_request
+def syncCaches():
+    # 其他进程有提交时才会读 change_log
+    changes.check()
+
+def productsChanged(productIds, changeId):
+    catalog.invalidate(changeId)
+    if productIds is None:
+        pageCache.bump()
+        suggestions.invalidate()
+        return
+    # 列表页都可能包含这些商品；商品页只丢掉改动过的那几个
+    def affected(key):
+        if key[0] != 'productDescription':
+            return True
+        productId = parse_qs(key[1].decode()).get('productId', [''])[0]
+        return productId.isdigit() and int(productId) in productIds
+    pageCache.drop(affected)
+    if suggestions.loaded:
+        with get_db() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT productId, name FROM products WHERE productId IN ({})'.format(','.join('?' * len(productIds))), list(productIds))
+            rows = cur.fetchall()
+        for productId in productIds:
+            suggestions.remove(productId)
+        for productId, name in rows:
+            suggestions.add(productId, name)
+
+def categoriesChanged(categoryIds, changeId):
+    # 分类名出现在每个页面的侧栏里
+    catalog.invalidate(changeId)
+    pageCache.bump()
+
+def usersChanged(userIds, changeId):
+    for userId in userIds if userIds is not None else [None]:
+        userChanges[userId] = changeId
+
+def imagesChanged(imageNames, changeId):
+    # 缩略图生成好了，之前用原图渲染的页面要重新渲染
+    variantIndex.invalidate()
+    pageCache.bump()
+
+def sessionsChanged(sids, changeId):
+    if isinstance(app.session_interface, ServerSessionInterface):
+        app.session_interface.store.forget(sids)
+
+changes.subscribe('products', productsChanged)
+changes.subscribe('categories', categoriesChanged)
+changes.subscribe('users', usersChanged)
+changes.subscribe('sessions', sessionsChanged)
+changes.subscribe('image_variants', imagesChanged)
+
+def loadGuestCart():
+    # session里存成扁平列表 [productId, quantity, ...]，比字典省cookie空间
+    items = session.get('guestCart', [])
+    return dict(zip(items[::2], items[1::2]))
+
+def saveGuestCart(cart):
+    if cart:
+        session['guestCart'] = [value for item in sorted(cart.items()) for value in item]
+    else:
+        session.pop('guestCart', None)
+
+def addGuestCartItem(productId):
+    """游客加入购物车只写session，不访问数据库；返回新的数量，商品不存在或购物车已满时返回 None"""
+    # 只接受目录里有的商品，否则随便一个 productId 都会占用购物车的行数
+    if productId is None or getCatalog().product(productId) is None:
+        return None
+    cart = loadGuestCart()
+    if productId not in cart and len(cart) >= app.config['GUEST_CART_LIMIT']:
+        return None
+    cart[productId] = min(cart.get(productId, 0) + 1, app.config['GUEST_CART_MAX_QUANTITY'])
+    saveGuestCart(cart)
+    return cart[productId]
+
+def getGuestCartTotal(cart):
+    # 价格从目录快照里取，已经下架的商品不计
+    snapshot = getCatalog()
+    products = (snapshot.product(productId) for productId in cart)
+    return sum(product[2] * cart[product[0]] for product in products if product is not None)
+
+def mergeGuestCart(conn, userId, cart):
+    # 一条 UPSERT 把游客购物车并入 kart，不存在的商品直接忽略
+    cur = conn.cursor()
+    cur.execute("INSERT INTO kart (userId, productId, quantity) SELECT ?, products.productId, guest.value FROM json_each(?) AS guest JOIN products ON products.productId = CAST(guest.key AS INTEGER) WHERE guest.value > 0 ON CONFLICT (userId, productId) DO UPDATE SET quantity = quantity + excluded.quantity", (userId, json.dumps(cart)))
+    # 游客购物车没有预留，登录后按库存补上
+    reservations.sync(conn, userId, list(cart), app.config['RESERVATION_TTL'])
+    sweeper.start()
+
+def updateCartCount(delta):
+    # 直接更新缓存，不需要重新count
+    if 'noOfItems' in session:
+        session['noOfItems'] = max(session['noOfItems'] + delta, 0)
 
 @app.route("/")
+@cachedPage
 def root():
     loggedIn, firstName, noOfItems = getLoginDetails()
-    with sqlite3.connect('database.db') as conn:
+    pageSize = app.config['PAGE_SIZE']
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    snapshot = getCatalog()
+    # 按 productId 做 keyset 分页，多取一行用来判断是否还有下一页/上一页
+    if before is not None:
+        itemData = snapshot.before(before, pageSize + 1)
+        hasPrev = len(itemData) > pageSize
+        hasNext = True
+        itemData = itemData[:pageSize][::-1]
+    else:
+        itemData = snapshot.after(after or 0, pageSize + 1)
+        hasPrev = after is not None
+        hasNext = len(itemData) > pageSize
+        itemData = itemData[:pageSize]
+    categoryData = getCategoryData()
+    prevUrl = url_for('root', before=itemData[0][0]) if itemData and hasPrev else None
+    nextUrl = url_for('root', after=itemData[-1][0]) if itemData and hasNext else None
+    itemData = parse(itemData)
+    return render_template('home.html', itemData=itemData, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems, categoryData=categoryData, prevUrl=prevUrl, nextUrl=nextUrl)
+
+@app.route("/search")
+def search():
+    loggedIn, firstName, noOfItems = getLoginDetails()
+    searchQuery = request.args.get('searchQuery', '').strip()
+    page = getPage()
+    pageSize = app.config['PAGE_SIZE']
+    matchQuery = ftsQuery(searchQuery)
+    itemData = []
+    with get_db() as conn:
         cur = conn.cursor()
-        cur.execute('SELECT productId, name, price, description, image, stock FROM products')
-        itemData = cur.fetchall()
-        cur.execute('SELECT categoryId, name FROM categories')
-        categoryData = cur.fetchall()
-    itemData = parse(itemData)   
-    return render_template('home.html', itemData=itemData, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems, categoryData=categoryData)
+        if matchQuery:
+            # name 的权重高于 description
+            cur.execute('SELECT products.productId, products.name, products.price, products.image FROM products_fts JOIN products ON products.productId = products_fts.rowid WHERE products_fts MATCH ? ORDER BY bm25(products_fts, 10.0, 1.0) LIMIT ? OFFSET ?', (matchQuery, pageSize + 1, (page - 1) * pageSize))
+            itemData = cur.fetchall()
+    categoryData = getCategoryData()
+    prevUrl = url_for('search', searchQuery=searchQuery, page=page - 1) if page > 1 else None
+    nextUrl = url_for('search', searchQuery=searchQuery, page=page + 1) if len(itemData) > pageSize else None
+    itemData = list(parse(itemData[:pageSize]))
+    return render_template('home.html', itemData=itemData, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems, categoryData=categoryData, prevUrl=prevUrl, nextUrl=nextUrl, searchQuery=searchQuery)
+
+@app.route("/suggest")
+def suggest():
+    if not suggestions.loaded:
+        with get_db() as conn:
+            cur = conn.cursor()
+            cur.execute('SELECT productId, name FROM products')
+            suggestions.load(cur)
+    results = suggestions.search(request.args.get('q', ''))
+    return {'suggestions': [{'productId': productId, 'name': name} for productId, name in results]}
+
+def ftsQuery(searchQuery):
+    # 只保留词本身并加上引号，用户输入不会造成FTS5语法错误；每个词都按前缀匹配
+    terms = re.findall(r'\w+', searchQuery)
+    return ' '.join('"{}"*'.format(term) for term in terms)
 
 @app.route("/add")
 def admin():
-    with sqlite3.connect('database.db') as conn:
+    with get_db() as conn:
         cur = conn.cursor()
         cur.execute("SELECT categoryId, name FROM categories")
         categories = cur.fetchall()
-    conn.close()
     return render_template('add.html', categories=categories)
 
 @app.route("/addItem", methods=["GET", "POST"])
@@ -72,63 +472,109 @@ def addItem():
         description = request.form['description']
         stock = int(request.form['stock'])
         categoryId = int(request.form['category'])
+        # SQLite 把 NaN 存成 NULL，无穷大也不是价格
+        if not math.isfinite(price):
+            print("invalid price")
+            return redirect(url_for('root'))
 
         #Uploading image procedure
         image = request.files['image']
         if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+            # 按内容哈希存原图，同一张图重复上传只存一份
+            extension = image.filename.rsplit('.', 1)[1].lower()
+            filename = images.store(image, imagePipeline.folder(), extension)
         imagename = filename
-        with sqlite3.connect('database.db') as conn:
+        productId = None
+        with get_db() as conn:
             try:
                 cur = conn.cursor()
                 cur.execute('''INSERT INTO products (name, price, description, image, stock, categoryId) VALUES (?, ?, ?, ?, ?, ?)''', (name, price, description, imagename, stock, categoryId))
                 conn.commit()
+                productId = cur.lastrowid
                 msg="added successfully"
             except:
                 msg="error occured"
                 conn.rollback()
-        conn.close()
+        # 已经提交了，下面刷新缓存出错也不能回滚
+        if productId is not None:
+            suggestions.add(productId, name)
+            catalogChanged()
+            # 缩略图在后台生成，不等它完成就返回
+            if imageVariants(imagename) is None:
+                imagePipeline.submit(imagename)
         print(msg)
         return redirect(url_for('root'))
 
 @app.route("/remove")
 def remove():
-    with sqlite3.connect('database.db') as conn:
-        cur = conn.cursor()
-        cur.execute('SELECT productId, name, price, description, image, stock FROM products')
-        data = cur.fetchall()
-    conn.close()
-    return render_template('remove.html', data=data)
+    # 列出所有商品，不分页；逐块从游标取行，页面边渲染边发送，内存占用跟商品数无关
+    data = db.stream_rows('SELECT productId, name, price, description, image, stock FROM products ORDER BY productId')
+    return renderPage('remove.html', data=data)
 
 @app.route("/removeItem")
 def removeItem():
-    productId = request.args.get('productId')
-    with sqlite3.connect('database.db') as conn:
+    productId = request.args.get('productId', type=int)
+    with get_db() as conn:
         try:
             cur = conn.cursor()
             cur.execute('DELETE FROM products WHERE productID = ?', (productId, ))
             conn.commit()
+            suggestions.remove(productId)
+            catalogChanged()
             msg = "Deleted successsfully"
         except:
             conn.rollback()
             msg = "Error occured"
-    conn.close()
     print(msg)
     return redirect(url_for('root'))
 
 @app.route("/displayCategory")
+@cachedPage
 def displayCategory():
         loggedIn, firstName, noOfItems = getLoginDetails()
-        categoryId = request.args.get("categoryId")
-        with sqlite3.connect('database.db') as conn:
+        categoryId = request.args.get("categoryId", type=int)
+        minPrice = request.args.get('minPrice', type=float)
+        maxPrice = request.args.get('maxPrice', type=float)
+        inStock = request.args.get('inStock') == '1'
+        sort = request.args.get('sort', '')
+        if sort not in CATEGORY_SORTS:
+            sort = ''
+        page = getPage()
+        pageSize = app.config['PAGE_SIZE']
+        snapshot = getCatalog()
+        categoryName = snapshot.categoryName(categoryId)
+        if categoryName is None:
+            abort(404)
+        conditions = ['categoryId = ?']
+        params = [categoryId]
+        if minPrice is not None:
+            conditions.append('price >= ?')
+            params.append(minPrice)
+        if maxPrice is not None:
+            conditions.append('price <= ?')
+            params.append(maxPrice)
+        if inStock:
+            conditions.append('stock > 0')
+            # 库存随时在变，有货筛选的结果不放进页面缓存
+            g.uncacheable = True
+        with get_db() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT products.productId, products.name, products.price, products.image, categories.name FROM products, categories WHERE products.categoryId = categories.categoryId AND categories.categoryId = ?", (categoryId, ))
-            data = cur.fetchall()
-        conn.close()
-        categoryName = data[0][4]
-        data = parse(data)
-        return render_template('displayCategory.html', data=data, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems, categoryName=categoryName)
+            # 索引里就有筛选和排序需要的列，只取 productId；名称和图片从目录快照里取
+            cur.execute('SELECT productId FROM products WHERE {} ORDER BY {} LIMIT ? OFFSET ?'.format(' AND '.join(conditions), CATEGORY_SORTS[sort]), params + [pageSize + 1, (page - 1) * pageSize])
+            productIds = [row[0] for row in cur]
+        args = request.args.to_dict()
+        prevUrl = url_for('displayCategory', **dict(args, page=page - 1)) if page > 1 else None
+        nextUrl = url_for('displayCategory', **dict(args, page=page + 1)) if len(productIds) > pageSize else None
+        data = list(parse(snapshot.rows(productIds[:pageSize])))
+        return render_template('displayCategory.html', data=data, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems, categoryId=categoryId, categoryName=categoryName, minPrice=minPrice, maxPrice=maxPrice, inStock=inStock, sort=sort, prevUrl=prevUrl, nextUrl=nextUrl)
+
+# 分类页的排序方式；同价格时再按 productId 排，分页结果稳定
+CATEGORY_SORTS = {
+    '': 'productId',
+    'price': 'price, productId',
+    'price_desc': 'price DESC, productId DESC',
+    'newest': 'productId DESC',
+}
 
 @app.route("/account/profile")
 def profileHome():
@@ -142,11 +588,10 @@ def editProfile():
     if 'email' not in session:
         return redirect(url_for('root'))
     loggedIn, firstName, noOfItems = getLoginDetails()
-    with sqlite3.connect('database.db') as conn:
+    with get_db() as conn:
         cur = conn.cursor()
         cur.execute("SELECT userId, email, firstName, lastName, address1, address2, zipcode, city, state, country, phone FROM users WHERE email = ?", (session['email'], ))
         profileData = cur.fetchone()
-    conn.close()
     return render_template("editProfile.html", profileData=profileData, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems)
 
 @app.route("/account/profile/changePassword", methods=["GET", "POST"])
@@ -158,7 +603,7 @@ def changePassword():
         oldPassword = hashlib.md5(oldPassword.encode()).hexdigest()
         newPassword = request.form['newpassword']
         newPassword = hashlib.md5(newPassword.encode()).hexdigest()
-        with sqlite3.connect('database.db') as conn:
+        with get_db() as conn:
             cur = conn.cursor()
             cur.execute("SELECT userId, password FROM users WHERE email = ?", (session['email'], ))
             userId, password = cur.fetchone()
@@ -173,7 +618,6 @@ def changePassword():
                 return render_template("changePassword.html", msg=msg)
             else:
                 msg = "Wrong password"
-        conn.close()
         return render_template("changePassword.html", msg=msg)
     else:
         return render_template("changePassword.html")
@@ -191,17 +635,18 @@ def updateProfile():
         state = request.form['state']
         country = request.form['country']
         phone = request.form['phone']
-        with sqlite3.connect('database.db') as con:
+        with get_db() as con:
                 try:
                     cur = con.cursor()
                     cur.execute('UPDATE users SET firstName = ?, lastName = ?, address1 = ?, address2 = ?, zipcode = ?, city = ?, state = ?, country = ?, phone = ? WHERE email = ?', (firstName, lastName, address1, address2, zipcode, city, state, country, phone, email))
 
                     con.commit()
                     msg = "Saved Successfully"
+                    if email == session.get('email'):
+                        session['firstName'] = firstName
                 except:
                     con.rollback()
                     msg = "Error occured"
-        con.close()
         return redirect(url_for('editProfile'))
 
 @app.route("/loginForm")
@@ -217,80 +662,360 @@ def login():
         email = request.form['email']
         password = request.form['password']
         if is_valid(email, password):
+            guestCart = loadGuestCart()
+            session.clear()
             session['email'] = email
+            user = getCurrentUser()
+            if guestCart and user is not None:
+                with get_db() as conn:
+                    try:
+                        mergeGuestCart(conn, user[0], guestCart)
+                    except:
+                        # 只读库写不了 kart，照常登录，游客购物车留在session里
+                        conn.rollback()
+                        saveGuestCart(guestCart)
+            # 登录时就把 userId、firstName 和购物车数量放进session
+            getLoginDetails()
             return redirect(url_for('root'))
         else:
             error = 'Invalid UserId / Password'
             return render_template('login.html', error=error)
 
+def fillStock(body):
+    # 可用库存每次都查一次主键，商品页本身可以一直缓存
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT stock FROM products WHERE productId = ?', (request.args.get('productId'), ))
+        row = cur.fetchone()
+    stock = str(row[0]) if row is not None else ''
+    return body.replace(STOCK_SLOT.encode(), stock.encode()), stock
+
 @app.route("/productDescription")
+@cachedPage(fill=fillStock)
 def productDescription():
     loggedIn, firstName, noOfItems = getLoginDetails()
-    productId = request.args.get('productId')
-    with sqlite3.connect('database.db') as conn:
-        cur = conn.cursor()
-        cur.execute('SELECT productId, name, price, description, image, stock FROM products WHERE productId = ?', (productId, ))
-        productData = cur.fetchone()
-    conn.close()
-    return render_template("productDescription.html", data=productData, loggedIn = loggedIn, firstName = firstName, noOfItems = noOfItems)
+    productId = request.args.get('productId', type=int)
+    productData = getCatalog().product(productId) if productId is not None else None
+    if productData is None:
+        abort(404)
+    # 库存在返回前由 fillStock 填入
+    return render_template("productDescription.html", data=productData, stock=STOCK_SLOT, loggedIn = loggedIn, firstName = firstName, noOfItems = noOfItems)
 
 @app.route("/addToCart")
 def addToCart():
     if 'email' not in session:
-        print(f"未登录用户尝试访问购物车")  # 调试
-        return redirect(url_for('loginForm'))
+        addGuestCartItem(request.args.get('productId', type=int))
+        return redirect(url_for('root'))
     else:
-        productId = int(request.args.get('productId'))
-        with sqlite3.connect('database.db') as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT userId FROM users WHERE email = ?", (session['email'], ))
-            userId = cur.fetchone()[0]
+        productId = request.args.get('productId', type=int)
+        # reserve 对不存在的商品也返回 False，先排除掉，免得提示成没货
+        if productId is None or getCatalog().product(productId) is None:
+            abort(404)
+        user = getCurrentUser()
+        if user is None:
+            return redirect(url_for('loginForm'))
+        userId = user[0]
+        with get_db() as conn:
             try:
-                cur.execute("INSERT INTO kart (userId, productId) VALUES (?, ?)", (userId, productId))
-                conn.commit()
-                msg = "Added successfully"
+                if reservations.reserve(conn, userId, productId, 1, app.config['RESERVATION_TTL']):
+                    addCartItem(conn, userId, productId)
+                    conn.commit()
+                    updateCartCount(1)
+                    sweeper.start()
+                    msg = "Added successfully"
+                else:
+                    # 回到商品页告诉用户没货了，购物车数量不变
+                    return redirect(url_for('productDescription', productId=productId, error='soldout'))
             except:
                 conn.rollback()
                 msg = "Error occured"
-        conn.close()
         return redirect(url_for('root'))
 
+@app.route("/api/cart/add", methods=["POST"])
+def apiAddToCart():
+    """加入购物车，只返回这一行和购物车数量，不重新渲染页面"""
+    user = getCurrentUser()
+    productId = request.values.get('productId', type=int)
+    if user is None:
+        # 游客和 /addToCart 一样写session里的购物车
+        product = getCatalog().product(productId) if productId is not None else None
+        if product is None:
+            return {'error': 'no such product'}, 404
+        quantity = addGuestCartItem(productId)
+        if quantity is None:
+            return {'error': 'cart is full'}, 400
+        return cartLine(productId, quantity, product[2], getGuestCartTotal(loadGuestCart()))
+    userId = user[0]
+    with get_db() as conn:
+        cur = conn.cursor()
+        cur.execute('SELECT price FROM products WHERE productId = ?', (productId, ))
+        row = cur.fetchone()
+        if row is None:
+            return {'error': 'no such product'}, 404
+        price = row[0]
+        if not reservations.reserve(conn, userId, productId, 1, app.config['RESERVATION_TTL']):
+            return {'error': 'out of stock'}, 409
+        quantity = addCartItem(conn, userId, productId)
+        totalPrice = getCartTotal(conn, userId)
+    updateCartCount(1)
+    sweeper.start()
+    return cartLine(productId, quantity, price, totalPrice)
+
+@app.route("/api/cart/remove", methods=["POST"])
+def apiRemoveFromCart():
+    user = getCurrentUser()
+    productId = request.values.get('productId', type=int)
+    if user is None:
+        cart = loadGuestCart()
+        cart.pop(productId, None)
+        saveGuestCart(cart)
+        return cartLine(productId, 0, 0, getGuestCartTotal(cart))
+    userId = user[0]
+    with get_db() as conn:
+        removed = removeCartItem(conn, userId, productId)
+        reservations.release(conn, userId, productId)
+        totalPrice = getCartTotal(conn, userId)
+    updateCartCount(-removed)
+    return cartLine(productId, 0, 0, totalPrice)
+
+@app.route("/api/cart/batch", methods=["POST"])
+def apiCartBatch():
+    """一次请求、一个事务里执行多个购物车操作
+
+    请求体: {"operations": [{"op": "add"|"remove"|"set", "productId": 1, "quantity": 2}, ...]}
+    """
+    user = getCurrentUser()
+    if user is None:
+        return {'error': 'login required'}, 401
+    userId = user[0]
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list):
+        return {'error': 'operations must be a list'}, 400
+    if len(operations) > app.config['CART_BATCH_LIMIT']:
+        return {'error': 'too many operations'}, 400
+
+    with get_db() as conn:
+        cur = conn.cursor()
+        productIds = {op.get('productId') for op in operations if isinstance(op, dict)}
+        productIds = [productId for productId in productIds if type(productId) is int]
+        cur.execute('SELECT productId FROM products WHERE productId IN ({})'.format(','.join('?' * len(productIds))), productIds)
+        known = {row[0] for row in cur}
+
+        # 先逐个校验，再把连续的同类操作合并成一次 executemany，保持原来的执行顺序
+        results = []
+        batches = []
+        for op in operations:
+            result, statement, params = checkCartOperation(op, known)
+            results.append(result)
+            if statement is None:
+                continue
+            if batches and batches[-1][0] == statement:
+                batches[-1][1].append((userId, ) + params)
+            else:
+                batches.append((statement, [(userId, ) + params]))
+        for statement, params in batches:
+            cur.executemany(statement, params)
+        # 预留数量跟着购物车变化，库存不够时只预留能预留的部分，下单时再检查
+        reservations.sync(conn, userId, [result['productId'] for result in results if result['ok']], app.config['RESERVATION_TTL'])
+        lines = getCartLines(conn, userId)
+    sweeper.start()
+
+    noOfItems = sum(line[4] for line in lines)
+    session['noOfItems'] = noOfItems
+    session['noOfItemsAt'] = int(time.time())
+    return {
+        'results': results,
+        'lines': [{'productId': line[0], 'quantity': line[4], 'lineTotal': line[5]} for line in lines],
+        'noOfItems': noOfItems,
+        'totalPrice': lines[0][6] if lines else 0
+    }
+
+CART_STATEMENTS = {
+    'add': "INSERT INTO kart (userId, productId, quantity) VALUES (?, ?, ?) ON CONFLICT (userId, productId) DO UPDATE SET quantity = quantity + excluded.quantity",
+    'set': "INSERT INTO kart (userId, productId, quantity) VALUES (?, ?, ?) ON CONFLICT (userId, productId) DO UPDATE SET quantity = excluded.quantity",
+    'remove': "DELETE FROM kart WHERE userId = ? AND productId = ?",
+}
+
+def checkCartOperation(op, known):
+    """校验一个批量操作，返回 (结果, SQL, 参数)；无效的操作 SQL 为 None"""
+    if not isinstance(op, dict):
+        return {'ok': False, 'error': 'invalid operation'}, None, None
+    name = op.get('op')
+    productId = op.get('productId')
+    quantity = op.get('quantity', 1)
+    result = {'op': name, 'productId': productId, 'ok': False}
+    if name not in CART_STATEMENTS:
+        result['error'] = 'unknown op'
+    elif type(productId) is not int or productId not in known:
+        result['error'] = 'no such product'
+    elif name != 'remove' and (type(quantity) is not int or not 0 <= quantity <= app.config['CART_MAX_QUANTITY'] or (name == 'add' and quantity == 0)):
+        result['error'] = 'invalid quantity'
+    else:
+        result['ok'] = True
+        if name == 'remove' or (name == 'set' and quantity == 0):
+            return result, CART_STATEMENTS['remove'], (productId, )
+        return result, CART_STATEMENTS[name], (productId, quantity)
+    return result, None, None
+
+def addCartItem(conn, userId, productId):
+    # 已经在购物车里就把数量加一，返回新的数量
+    cur = conn.cursor()
+    cur.execute("INSERT INTO kart (userId, productId, quantity) VALUES (?, ?, 1) ON CONFLICT (userId, productId) DO UPDATE SET quantity = quantity + 1 RETURNING quantity", (userId, productId))
+    return cur.fetchone()[0]
+
+def removeCartItem(conn, userId, productId):
+    # 删除这一行，返回删掉的数量
+    cur = conn.cursor()
+    cur.execute("DELETE FROM kart WHERE userId = ? AND productId = ? RETURNING quantity", (userId, productId))
+    row = cur.fetchone()
+    return row[0] if row is not None else 0
+
+def getCartLines(conn, userId):
+    # 行小计和购物车总价在同一条查询里算出
+    cur = conn.cursor()
+    cur.execute("SELECT products.productId, products.name, products.price, products.image, kart.quantity, products.price * kart.quantity, sum(products.price * kart.quantity) OVER () FROM kart JOIN products ON products.productId = kart.productId WHERE kart.userId = ?", (userId, ))
+    return cur.fetchall()
+
+def getCartTotal(conn, userId):
+    cur = conn.cursor()
+    cur.execute("SELECT coalesce(sum(products.price * kart.quantity), 0) FROM kart JOIN products ON products.productId = kart.productId WHERE kart.userId = ?", (userId, ))
+    return cur.fetchone()[0]
+
+def cartLine(productId, quantity, price, totalPrice):
+    loggedIn, firstName, noOfItems = getLoginDetails()
+    return {
+        'productId': productId,
+        'quantity': quantity,
+        'lineTotal': price * quantity,
+        'noOfItems': noOfItems,
+        'totalPrice': totalPrice
+    }
+
 @app.route("/cart")
 def cart():
     if 'email' not in session:
         print(f"未登录用户尝试查看购物车")  # 调试
         return redirect(url_for('loginForm'))
     loggedIn, firstName, noOfItems = getLoginDetails()
-    email = session['email']
-    with sqlite3.connect('database.db') as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT userId FROM users WHERE email = ?", (email, ))
-        userId = cur.fetchone()[0]
-        cur.execute("SELECT products.productId, products.name, products.price, products.image FROM products, kart WHERE products.productId = kart.productId AND kart.userId = ?", (userId, ))
-        products = cur.fetchall()
-    totalPrice = 0
-    for row in products:
-        totalPrice += row[2]
+    if not loggedIn:
+        return redirect(url_for('loginForm'))
+    userId = getCurrentUser()[0]
+    with get_db() as conn:
+        products = getCartLines(conn, userId)
+    totalPrice = products[0][6] if products else 0
     return render_template("cart.html", products = products, totalPrice=totalPrice, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems)
 
+@app.route("/checkout", methods=["GET", "POST"])
+def checkout():
+    if 'email' not in session:
+        return redirect(url_for('loginForm'))
+    loggedIn, firstName, noOfItems = getLoginDetails()
+    if not loggedIn:
+        return redirect(url_for('loginForm'))
+    userId = getCurrentUser()[0]
+    error = ''
+    if request.method == "POST":
+        orderId, shortItems = placeOrder(get_db(), userId)
+        if orderId is not None:
+            session['noOfItems'] = 0
+            return redirect(url_for('orders'))
+        if shortItems:
+            error = 'Not enough stock for: ' + ', '.join(shortItems)
+        else:
+            error = 'Your cart is empty'
+    with get_db() as conn:
+        products = getCartLines(conn, userId)
+    totalPrice = products[0][6] if products else 0
+    return render_template("checkout.html", products=products, totalPrice=totalPrice, error=error, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems)
+
+def placeOrder(conn, userId):
+    """在一个 BEGIN IMMEDIATE 事务里把购物车转成订单
+
+    已预留的数量在加入购物车时就扣过库存，这里只扣没有预留到的部分；
+    扣库存用带条件的 UPDATE，库存不够的商品不会被扣成负数。
+    返回 (orderId, 库存不足的商品名)；下单失败时 orderId 为 None。
+    """
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        cur.execute("SELECT kart.productId, products.name, products.price, kart.quantity FROM kart JOIN products ON products.productId = kart.productId WHERE kart.userId = ?", (userId, ))
+        lines = cur.fetchall()
+        held = reservations.consume(conn, userId)
+        shortItems = []
+        for productId, name, price, quantity in lines:
+            needed = quantity - held.pop(productId, 0)
+            if needed > 0:
+                cur.execute("UPDATE products SET stock = stock - ? WHERE productId = ? AND stock >= ?", (needed, productId, needed))
+                if cur.rowcount != 1:
+                    shortItems.append(name)
+            elif needed < 0:
+                held[productId] = -needed
+        # 预留多于购物车数量的部分还给库存
+        cur.executemany("UPDATE products SET stock = stock + ? WHERE productId = ?", [(quantity, productId) for productId, quantity in held.items()])
+        if not lines or shortItems:
+            conn.rollback()
+            return None, shortItems
+        total = sum(price * quantity for productId, name, price, quantity in lines)
+        cur.execute("INSERT INTO orders (userId, createdAt, total) VALUES (?, ?, ?)", (userId, int(time.time()), total))
+        orderId = cur.lastrowid
+        cur.executemany("INSERT INTO order_items (orderId, productId, name, price, quantity) VALUES (?, ?, ?, ?, ?)", [(orderId, ) + line for line in lines])
+        cur.execute("DELETE FROM kart WHERE userId = ?", (userId, ))
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return orderId, []
+
+@app.route("/account/orders")
+def orders():
+    if 'email' not in session:
+        return redirect(url_for('loginForm'))
+    loggedIn, firstName, noOfItems = getLoginDetails()
+    if not loggedIn:
+        return redirect(url_for('loginForm'))
+    userId = getCurrentUser()[0]
+    pageSize = app.config['ORDERS_PAGE_SIZE']
+    # orderId 在 SQLite 的整数范围内，超出范围的 before 截断到边界，不会溢出
+    before = min(max(request.args.get('before', 2 ** 63 - 1, type=int), 0), 2 ** 63 - 1)
+    with get_db() as conn:
+        cur = conn.cursor()
+        # 最新的订单在前，按 orderId 做 keyset 分页
+        cur.execute("SELECT orderId, createdAt, total FROM orders WHERE userId = ? AND orderId < ? ORDER BY orderId DESC LIMIT ?", (userId, before, pageSize + 1))
+        orderData = cur.fetchall()
+        nextUrl = url_for('orders', before=orderData[pageSize - 1][0]) if len(orderData) > pageSize else None
+        orderData = orderData[:pageSize]
+        items = {}
+        if orderData:
+            orderIds = [row[0] for row in orderData]
+            cur.execute("SELECT orderId, productId, name, price, quantity FROM order_items WHERE orderId IN ({})".format(','.join('?' * len(orderIds))), orderIds)
+            for row in cur:
+                items.setdefault(row[0], []).append(row[1:])
+    orderData = [(orderId, time.strftime('%Y-%m-%d %H:%M', time.localtime(createdAt)), total, items.get(orderId, [])) for orderId, createdAt, total in orderData]
+    return render_template("orders.html", orderData=orderData, nextUrl=nextUrl, loggedIn=loggedIn, firstName=firstName, noOfItems=noOfItems)
+
 @app.route("/removeFromCart")
 def removeFromCart():
     if 'email' not in session:
-        return redirect(url_for('loginForm'))
-    email = session['email']
+        cart = loadGuestCart()
+        cart.pop(request.args.get('productId', type=int), None)
+        saveGuestCart(cart)
+        return redirect(url_for('root'))
     productId = int(request.args.get('productId'))
-    with sqlite3.connect('database.db') as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT userId FROM users WHERE email = ?", (email, ))
-        userId = cur.fetchone()[0]
+    user = getCurrentUser()
+    if user is None:
+        return redirect(url_for('loginForm'))
+    userId = user[0]
+    with get_db() as conn:
         try:
-            cur.execute("DELETE FROM kart WHERE userId = ? AND productId = ?", (userId, productId))
+            removed = removeCartItem(conn, userId, productId)
+            reservations.release(conn, userId, productId)
             conn.commit()
+            updateCartCount(-removed)
             msg = "removed successfully"
         except:
             conn.rollback()
             msg = "error occured"
-    conn.close()
     return redirect(url_for('root'))
 
 
@@ -317,13 +1042,14 @@ def is_valid(email, password):
     if not email or not password:
         return False  # 直接返回，不访问数据库
 
-    con = sqlite3.connect('database.db')
-    cur = con.cursor()
-    cur.execute('SELECT email, password FROM users')
-    data = cur.fetchall()
-    for row in data:
-        if row[0] == email and row[1] == hashlib.md5(password.encode()).hexdigest():
-            return True
+    passwordHash = hashlib.md5(password.encode()).hexdigest()
+    with get_db() as con:
+        cur = con.cursor()
+        # 走 idx_users_email 索引，只取这个邮箱的行（重复注册时可能有多行）
+        cur.execute('SELECT password FROM users WHERE email = ?', (email, ))
+        for row in cur:
+            if row[0] and hmac.compare_digest(row[0], passwordHash):
+                return True
     return False
 
 @app.route("/register", methods = ['GET', 'POST'])
@@ -342,7 +1068,7 @@ def register():
         country = request.form['country']
         phone = request.form['phone']
 
-        with sqlite3.connect('database.db') as con:
+        with get_db() as con:
             try:
                 cur = con.cursor()
                 cur.execute('INSERT INTO users (password, email, firstName, lastName, address1, address2, zipcode, city, state, country, phone) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (hashlib.md5(password.encode()).hexdigest(), email, firstName, lastName, address1, address2, zipcode, city, state, country, phone))
@@ -353,7 +1079,6 @@ def register():
             except:
                 con.rollback()
                 msg = "Error occured"
-        con.close()
         return render_template("login.html", error=msg)
 
 @app.route("/registerationForm")
@@ -366,18 +1091,21 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def getPage():
+    # 页码从1开始，超出 MAX_PAGE 的返回400
+    page = max(request.args.get('page', 1, type=int), 1)
+    if page > app.config['MAX_PAGE']:
+        abort(400)
+    return page
+
 def parse(data):
-    ans = []
-    i = 0
-    while i < len(data):
-        curr = []
-        for j in range(7):
-            if i >= len(data):
-                break
-            curr.append(data[i])
-            i += 1
-        ans.append(curr)
-    return ans
+    # 把商品按每行7个分组，data 可以是任意可迭代对象（包括游标），逐行消费
+    rows = iter(data)
+    while True:
+        curr = list(islice(rows, 7))
+        if not curr:
+            break
+        yield curr
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class PageCache:
+    """渲染好的页面缓存，按字节数做LRU淘汰
+
+    每个条目记录生成时的目录版本号，目录一变（addItem/removeItem 调用 bump），
+    旧版本的条目就不再命中。
+    """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.version = 0
+        self.modified = time.time()
+        self._entries = OrderedDict()    # key -> (version, body, etag)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def bump(self):
+        """目录发生变化，所有已缓存的页面作废"""
+        with self._lock:
+            self.version += 1
+            self.modified = time.time()
+            self._entries.clear()
+            self._bytes = 0
+
+    def drop(self, match):
+        """只作废 match(key) 为真的页面"""
+        with self._lock:
+            for key in [key for key in self._entries if match(key)]:
+                self._bytes -= len(self._entries.pop(key)[1])
+            self.modified = time.time()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self.version:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, version, body):
+        etag = makeEtag(body)
+        size = len(body)
+        with self._lock:
+            # 渲染期间目录已经变了，或者单个页面就超过预算，都不缓存
+            if version != self.version or size > self.maxBytes:
+                return etag
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._entries[key] = (version, body, etag)
+            self._bytes += size
+            while self._bytes > self.maxBytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted[1])
+                self._stats['evictions'] += 1
+        return etag
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        stats['maxBytes'] = self.maxBytes
+        stats['version'] = self.version
+        return stats
+
+
+def makeEtag(body):
+    return hashlib.md5(body).hexdigest()
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import db
+
+
+def reserve(conn, userId, productId, quantity, ttl):
+    """加入购物车时预留库存，库存不足时返回 False
+
+    预留直接从 products.stock 里扣掉，所以 stock 始终是别人还能买到的数量。
+    调用方负责提交事务。
+    """
+    cur = conn.cursor()
+    cur.execute("UPDATE products SET stock = stock - ? WHERE productId = ? AND stock >= ?", (quantity, productId, quantity))
+    if cur.rowcount != 1:
+        return False
+    cur.execute("INSERT INTO reservations (userId, productId, quantity, expiresAt) VALUES (?, ?, ?, ?) ON CONFLICT (userId, productId) DO UPDATE SET quantity = quantity + excluded.quantity, expiresAt = excluded.expiresAt", (userId, productId, quantity, int(time.time()) + ttl))
+    return True
+
+
+def release(conn, userId, productId):
+    """取消一行的预留，把数量还给库存，返回归还的数量"""
+    cur = conn.cursor()
+    cur.execute("DELETE FROM reservations WHERE userId = ? AND productId = ? RETURNING quantity", (userId, productId))
+    row = cur.fetchone()
+    if row is None:
+        return 0
+    cur.execute("UPDATE products SET stock = stock + ? WHERE productId = ?", (row[0], productId))
+    return row[0]
+
+
+def sync(conn, userId, productIds, ttl):
+    """让这些商品的预留数量跟购物车里的数量一致
+
+    购物车数量变多时尽量多预留（最多预留到可用库存），变少时把多出的还给库存。
+    """
+    if not productIds:
+        return
+    cur = conn.cursor()
+    placeholders = ','.join('?' * len(productIds))
+    cur.execute("SELECT products.productId, products.stock, coalesce(kart.quantity, 0), coalesce(reservations.quantity, 0) FROM products LEFT JOIN kart ON kart.userId = ? AND kart.productId = products.productId LEFT JOIN reservations ON reservations.userId = ? AND reservations.productId = products.productId WHERE products.productId IN ({})".format(placeholders), [userId, userId] + list(productIds))
+    expiresAt = int(time.time()) + ttl
+    for productId, stock, wanted, held in cur.fetchall():
+        target = min(wanted, held + stock)
+        if target == held:
+            continue
+        cur.execute("UPDATE products SET stock = stock - ? WHERE productId = ?", (target - held, productId))
+        if target == 0:
+            cur.execute("DELETE FROM reservations WHERE userId = ? AND productId = ?", (userId, productId))
+        else:
+            cur.execute("INSERT INTO reservations (userId, productId, quantity, expiresAt) VALUES (?, ?, ?, ?) ON CONFLICT (userId, productId) DO UPDATE SET quantity = excluded.quantity, expiresAt = excluded.expiresAt", (userId, productId, target, expiresAt))
+
+
+def consume(conn, userId):
+    """下单时取走这个用户的全部预留，返回 {productId: 已预留数量}
+
+    已过期但还没被清理的预留也算在内，因为它们的库存还没有归还。
+    """
+    cur = conn.cursor()
+    cur.execute("DELETE FROM reservations WHERE userId = ? RETURNING productId, quantity", (userId, ))
+    return dict(cur.fetchall())
+
+
+def sweep(conn, limit, now=None):
+    """归还最多 limit 个过期预留，返回处理的行数
+
+    每次只处理一批，事务很短，不会长时间占住写锁。
+    """
+    now = int(time.time()) if now is None else now
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE')
+    try:
+        cur.execute("DELETE FROM reservations WHERE (userId, productId) IN (SELECT userId, productId FROM reservations WHERE expiresAt <= ? LIMIT ?) RETURNING productId, quantity", (now, limit))
+        expired = cur.fetchall()
+        returned = {}
+        for productId, quantity in expired:
+            returned[productId] = returned.get(productId, 0) + quantity
+        cur.executemany("UPDATE products SET stock = stock + ? WHERE productId = ?", [(quantity, productId) for productId, quantity in returned.items()])
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return len(expired)
+
+
+class ReservationSweeper:
+    """后台线程，定期把过期的预留还给库存
+
+    每一轮最多处理 batchSize 行；这一批满了说明还有积压，稍等片刻再处理下一批，
+    否则等到下一个周期。第一次有预留时才启动。
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = {'cycles': 0, 'released': 0, 'errors': 0}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self.app.config['RESERVATION_SWEEP_INTERVAL'] <= 0:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='reservation-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+
+    def runOnce(self):
+        """处理一批过期预留，返回处理的行数"""
+        pool = db.get_pool(self.app)
+        conn = pool.acquire()
+        try:
+            released = sweep(conn, self.app.config['RESERVATION_SWEEP_BATCH'])
+        finally:
+            pool.release(conn)
+        self._stats['cycles'] += 1
+        self._stats['released'] += released
+        return released
+
+    def _run(self):
+        delay = self.app.config['RESERVATION_SWEEP_INTERVAL']
+        while not self._stop.wait(delay):
+            try:
+                backlog = self.runOnce() >= self.app.config['RESERVATION_SWEEP_BATCH']
+            except Exception:
+                # 数据库忙或者临时出错，下个周期再试
+                self._stats['errors'] += 1
+                backlog = False
+            delay = 0.05 if backlog else self.app.config['RESERVATION_SWEEP_INTERVAL']
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats['running'] = self._thread is not None
+        return stats
@@ -0,0 +1,199 @@
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from changelog import origin
+from db import get_db
+
+# 未修改的session至少隔这么久才刷新一次过期时间（秒），避免每个请求都写库
+TOUCH_INTERVAL = 60 * 60
+# 每隔多久清理一批过期session（秒），每批最多删除的行数
+CLEANUP_INTERVAL = 60
+CLEANUP_BATCH = 500
+
+
+class SessionStoreError(RuntimeError):
+    """session写不进数据库（例如只读库），不能假装已经保存"""
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """服务端session，cookie里只有一个随机的 sid"""
+
+    def __init__(self, initial=None, sid=None, expiresAt=0, backend='new'):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.expiresAt = expiresAt
+        # 这次请求的session从哪里读到的：memory / sqlite / new
+        self.backend = backend
+        self.modified = False
+        self.rotate = False
+        self.failed = False
+
+    def clear(self):
+        # 登录、退出都会先 clear()，顺便换一个新的 sid，防止session固定攻击
+        self.rotate = True
+        CallbackDict.clear(self)
+
+
+class SessionStore:
+    """进程内的LRU缓存 + SQLite sessions表
+
+    写入时同时写缓存和数据库，读的时候先查缓存，缓存里没有再查库。
+    缓存保存序列化后的字符串，每个请求拿到的都是自己的副本。
+    只缓存本进程最后写入的session：同一进程的连续写入不记 change_log，
+    别的进程写的session如果缓存下来，之后的修改就收不到通知了。
+    """
+
+    def __init__(self, maxEntries):
+        self.maxEntries = maxEntries
+        self._entries = OrderedDict()    # sid -> (expiresAt, data)
+        self._lock = threading.Lock()
+        self._nextCleanup = 0
+        self._stats = {'hits': 0, 'misses': 0, 'writes': 0, 'expired': 0}
+
+    def _remember(self, sid, expiresAt, data):
+        with self._lock:
+            self._entries[sid] = (expiresAt, data)
+            self._entries.move_to_end(sid)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+
+    def load(self, conn, sid, now):
+        """返回 (expiresAt, data, backend)，不存在或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is not None:
+                self._entries.move_to_end(sid)
+        if entry is not None:
+            if entry[0] > now:
+                self._stats['hits'] += 1
+                return entry[0], entry[1], 'memory'
+            with self._lock:
+                self._entries.pop(sid, None)
+        self._stats['misses'] += 1
+        row = conn.execute('SELECT expiresAt, data, writer FROM sessions WHERE sid = ?', (sid, )).fetchone()
+        if row is None or row[0] <= now:
+            return None
+        if row[2] == origin():
+            self._remember(sid, row[0], row[1])
+        return row[0], row[1], 'sqlite'
+
+    def save(self, conn, sid, expiresAt, data):
+        with conn:
+            conn.execute('INSERT INTO sessions (sid, data, expiresAt, writer) VALUES (?, ?, ?, ?) ON CONFLICT (sid) DO UPDATE SET data = excluded.data, expiresAt = excluded.expiresAt, writer = excluded.writer', (sid, data, expiresAt, origin()))
+        self._remember(sid, expiresAt, data)
+        self._stats['writes'] += 1
+
+    def delete(self, conn, sid):
+        with self._lock:
+            self._entries.pop(sid, None)
+        with conn:
+            conn.execute('DELETE FROM sessions WHERE sid = ?', (sid, ))
+
+    def forget(self, sids=None):
+        """其他进程改过这些session，丢掉本地缓存；sids 为 None 时全部丢掉"""
+        with self._lock:
+            if sids is None:
+                self._entries.clear()
+                return
+            for sid in sids:
+                self._entries.pop(sid, None)
+
+    def cleanup(self, conn, now):
+        """隔一段时间删一批过期的session，每次的工作量有上限"""
+        if now < self._nextCleanup:
+            return 0
+        self._nextCleanup = now + CLEANUP_INTERVAL
+        with conn:
+            cur = conn.execute('DELETE FROM sessions WHERE sid IN (SELECT sid FROM sessions WHERE expiresAt <= ? LIMIT ?)', (now, CLEANUP_BATCH))
+        with self._lock:
+            for sid in [sid for sid, entry in self._entries.items() if entry[0] <= now]:
+                del self._entries[sid]
+        self._stats['expired'] += cur.rowcount
+        return cur.rowcount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        stats['maxEntries'] = self.maxEntries
+        return stats
+
+
+class ServerSessionInterface(SessionInterface):
+    """把session存在服务端，cookie里只放 sid，视图里的 session 用法不变"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, maxEntries, watcher=None):
+        self.store = SessionStore(maxEntries)
+        # 打开session早于 before_request，先同步其他进程的改动再读缓存
+        self.watcher = watcher
+
+    def open_session(self, app, request):
+        # 打开session时还没有匹配路由，request.endpoint 是空的，按地址判断静态文件
+        if app.static_url_path is not None and request.path.startswith(app.static_url_path + '/'):
+            return ServerSession()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            if self.watcher is not None:
+                self.watcher.check()
+            now = int(time.time())
+            try:
+                entry = self.store.load(get_db(), sid, now)
+            except sqlite3.Error:
+                entry = None
+            if entry is not None:
+                expiresAt, data, backend = entry
+                return ServerSession(self.serializer.loads(data), sid, expiresAt, backend)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.sid is None and not session:
+            # 没有任何内容的新session（例如只浏览的游客、静态文件）不访问数据库
+            return
+        if session.failed:
+            # 已经报过错，生成500页面时不再重试
+            return
+        now = int(time.time())
+        conn = get_db()
+        try:
+            if session.sid is not None and (session.rotate or not session):
+                self.store.delete(conn, session.sid)
+            if not session:
+                response.delete_cookie(name, domain=domain, path=path)
+                return
+            lifetime = int(app.permanent_session_lifetime.total_seconds())
+            expiresAt = now + lifetime
+            if session.sid is None or session.rotate:
+                session.sid = secrets.token_urlsafe(32)
+            elif not session.modified and session.expiresAt - now > lifetime - TOUCH_INTERVAL:
+                # 内容没变并且最近刷新过过期时间，不需要写库也不需要重发cookie
+                return
+            self.store.save(conn, session.sid, expiresAt, self.serializer.dumps(dict(session)))
+            self.store.cleanup(conn, now)
+        except sqlite3.Error as e:
+            # 只读库等情况下写不进去；不能当作已保存，否则登录会悄悄失败
+            session.failed = True
+            raise SessionStoreError('cannot save session: {}'.format(e)) from e
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
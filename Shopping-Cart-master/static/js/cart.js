@@ -0,0 +1,59 @@
+// 购物车的加入/删除通过JSON接口完成，不再跳转回首页重新渲染
+window.addEventListener("load", function () {
+    var links = document.querySelectorAll("a[data-cart-action]");
+    for (var i = 0; i < links.length; i++) {
+        links[i].addEventListener("click", onCartClick);
+    }
+});
+
+function onCartClick(event) {
+    var link = event.currentTarget;
+    var action = link.getAttribute("data-cart-action");
+    var body = new FormData();
+    body.append("productId", link.getAttribute("data-product-id"));
+    event.preventDefault();
+    fetch("/api/cart/" + action, {method: "POST", body: body, credentials: "same-origin"})
+        .then(function (response) {
+            if (response.status == 409) {
+                // 没货了，留在当前页面提示
+                var status = document.getElementById("cartStatus");
+                if (status) {
+                    status.textContent = "Out of stock";
+                    return null;
+                }
+            }
+            if (!response.ok) {
+                // 接口出错时退回到原来的链接，由它决定跳转到哪里
+                window.location = link.href;
+                return null;
+            }
+            return response.json();
+        })
+        .then(function (data) {
+            if (data) {
+                updateCart(link, action, data);
+            }
+        });
+}
+
+function updateCart(link, action, data) {
+    var count = document.getElementById("cartCount");
+    if (count) {
+        count.textContent = data.noOfItems;
+    }
+    var total = document.getElementById("totalPrice");
+    if (total) {
+        total.textContent = "$" + data.totalPrice;
+    }
+    if (action == "remove") {
+        var line = link.closest("[data-cart-line]");
+        if (line) {
+            line.parentNode.removeChild(line);
+        }
+    } else {
+        var status = document.getElementById("cartStatus");
+        if (status) {
+            status.textContent = "Added, " + data.quantity + " in cart";
+        }
+    }
+}
@@ -0,0 +1,29 @@
+// 搜索框输入联想
+window.addEventListener("load", function () {
+    var box = document.getElementById("searchBox");
+    var list = document.getElementById("suggestions");
+    if (!box || !list) {
+        return;
+    }
+    var timer = null;
+    box.addEventListener("input", function () {
+        clearTimeout(timer);
+        timer = setTimeout(function () {
+            var query = box.value.trim();
+            if (query == "") {
+                list.innerHTML = "";
+                return;
+            }
+            fetch("/suggest?q=" + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    list.innerHTML = "";
+                    data.suggestions.forEach(function (item) {
+                        var option = document.createElement("option");
+                        option.value = item.name;
+                        list.appendChild(option);
+                    });
+                });
+        }, 100);
+    });
+});
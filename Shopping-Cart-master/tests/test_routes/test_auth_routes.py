@@ -209,3 +209,22 @@ def test_update_profile(account_with_editprofile):
 
 
 
+
+
+def test_server_side_session(logged_in_user):
+    """测试服务端session：cookie里只有sid，退出后旧的sid失效"""
+    print("Testing server-side session...")
+
+    response = logged_in_user.get(f"{BASE_URL}/debug-auth")
+    data = response.json()
+    if data["session_backend"] == "cookie":
+        pytest.skip("server-side sessions are disabled")
+    assert data["has_email"]
+    assert data["session_backend"] in ("memory", "sqlite")
+    sid = logged_in_user.cookies["session"]
+    assert TEST_USER["email"] not in sid
+
+    logged_in_user.get(f"{BASE_URL}/logout")
+    stale = requests.get(f"{BASE_URL}/debug-auth", cookies={"session": sid}).json()
+    assert not stale["has_email"], "Session id should be invalid after logout"
+    print("✓ Session stored on the server")
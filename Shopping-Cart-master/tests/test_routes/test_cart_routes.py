@@ -5,6 +5,8 @@ import requests
 from bs4 import BeautifulSoup
 import re
 import os
+import base64
+import uuid
 
 # 从环境变量读取BASE_URL
 BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
@@ -41,13 +43,22 @@ def registered_user(session):
 
 @pytest.fixture(scope="function")
 def logged_in_user(registered_user):
-    """登录用户并返回session"""
+    """登录用户并返回session；测试前后清空购物车，释放预留的库存"""
     print("Logging in test user...")
     registered_user.post(
         f"{BASE_URL}/login",
         data={"email": TEST_USER["email"], "password": TEST_USER["password"]}
     )
-    return registered_user
+    clear_cart(registered_user)
+    yield registered_user
+    clear_cart(registered_user)
+
+
+def clear_cart(session):
+    """删除购物车里的所有商品，预留的库存随之释放"""
+    response = session.get(f"{BASE_URL}/cart")
+    for product_id in set(re.findall(r'removeFromCart\?productId=(\d+)', response.text)):
+        session.get(f"{BASE_URL}/removeFromCart?productId={product_id}")
 
 
 @pytest.fixture(scope="function")
@@ -124,6 +135,22 @@ def test_add_to_cart(logged_in_user):
     print("✓ Product added to cart successfully")
 
 
+def test_add_to_cart_out_of_stock(logged_in_user):
+    """测试库存不够时提示用户"""
+    print("Testing add to cart when out of stock...")
+
+    product_id = get_product_id(logged_in_user)
+    # 一直加到没货为止，测试结束时 fixture 会清空购物车释放库存
+    for _ in range(100):
+        response = logged_in_user.get(f"{BASE_URL}/addToCart?productId={product_id}")
+        if "productDescription" in response.url:
+            break
+    assert "productDescription" in response.url, "Should be sent back to the product page when out of stock"
+    status = BeautifulSoup(response.text, 'html.parser').find(id='cartStatus')
+    assert "out of stock" in status.get_text().lower()
+    print("✓ Out of stock message shown")
+
+
 def test_view_cart(logged_in_user):
     """测试查看购物车"""
     print("Testing view cart...")
@@ -176,4 +203,229 @@ def test_unauthorized_cart_access(session):
 
     assert response.status_code == 200, f"Expected 200, got {response.status_code}"
     assert "register here" in response.text.lower()
-    print("✓ Unauthorized cart access handled c_orrectly")
\ No newline at end of file
+    print("✓ Unauthorized cart access handled c_orrectly")
+
+def test_api_add_to_cart(logged_in_user):
+    """测试JSON接口加入购物车"""
+    print("Testing cart API add...")
+
+    product_id = get_product_id(logged_in_user)
+    first = logged_in_user.post(f"{BASE_URL}/api/cart/add", data={"productId": product_id})
+    second = logged_in_user.post(f"{BASE_URL}/api/cart/add", data={"productId": product_id})
+
+    assert first.status_code == 200, f"Expected 200, got {first.status_code}"
+    assert second.json()["quantity"] == first.json()["quantity"] + 1
+    assert second.json()["noOfItems"] == first.json()["noOfItems"] + 1
+    assert second.json()["lineTotal"] > first.json()["lineTotal"]
+    print("✓ Cart API adds items and returns the updated line")
+
+
+def test_api_remove_from_cart(user_with_cart_item):
+    """测试JSON接口从购物车移除商品"""
+    print("Testing cart API remove...")
+
+    product_id = get_product_id(user_with_cart_item)
+    response = user_with_cart_item.post(f"{BASE_URL}/api/cart/remove", data={"productId": product_id})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert response.json()["quantity"] == 0
+
+    cart_response = user_with_cart_item.get(f"{BASE_URL}/cart")
+    assert f"removeFromCart?productId={product_id}" not in cart_response.text
+    print("✓ Cart API removes the line")
+
+
+def test_api_cart_guest(session):
+    """测试未登录时购物车接口使用游客购物车"""
+    print("Testing cart API as a guest...")
+
+    product_id = get_product_id(session)
+    response = session.post(f"{BASE_URL}/api/cart/add", data={"productId": product_id})
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert response.json()["noOfItems"] == 1
+
+    home_soup = BeautifulSoup(session.get(f"{BASE_URL}/").text, 'html.parser')
+    assert "CART 1" in home_soup.find('a', href='/cart').get_text()
+
+    response = session.post(f"{BASE_URL}/api/cart/remove", data={"productId": product_id})
+    assert response.json()["noOfItems"] == 0
+
+    response = session.post(f"{BASE_URL}/api/cart/add", data={"productId": 99999999})
+    assert response.status_code == 404, f"Expected 404, got {response.status_code}"
+
+    # 批量接口只给登录用户用
+    response = session.post(f"{BASE_URL}/api/cart/batch", json={"operations": []})
+    assert response.status_code == 401, f"Expected 401, got {response.status_code}"
+    print("✓ Guest cart API uses the session cart")
+
+
+def test_api_cart_batch(logged_in_user):
+    """测试批量购物车操作"""
+    print("Testing cart batch API...")
+
+    product_id = int(get_product_id(logged_in_user))
+    response = logged_in_user.post(f"{BASE_URL}/api/cart/batch", json={"operations": [
+        {"op": "set", "productId": product_id, "quantity": 3},
+        {"op": "add", "productId": product_id, "quantity": 2},
+        {"op": "add", "productId": -1},
+        {"op": "add", "productId": product_id, "quantity": 10 ** 30},
+    ]})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    data = response.json()
+    assert [result["ok"] for result in data["results"]] == [True, True, False, False]
+    assert data["results"][3]["error"] == "invalid quantity"
+    line = [line for line in data["lines"] if line["productId"] == product_id][0]
+    assert line["quantity"] == 5
+    assert data["noOfItems"] == sum(line["quantity"] for line in data["lines"])
+    print("✓ Cart batch API applies operations in order")
+
+
+def test_guest_cart_merged_on_login(session):
+    """测试游客购物车在登录后并入用户购物车"""
+    print("Testing guest cart merge...")
+
+    product_id = get_product_id(session)
+    response = session.get(f"{BASE_URL}/addToCart?productId={product_id}")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+
+    home_soup = BeautifulSoup(session.get(f"{BASE_URL}/").text, 'html.parser')
+    assert "CART 1" in home_soup.find('a', href='/cart').get_text()
+
+    session.post(f"{BASE_URL}/register", data=TEST_USER)
+    session.post(f"{BASE_URL}/login", data={"email": TEST_USER["email"], "password": TEST_USER["password"]})
+    cart_response = session.get(f"{BASE_URL}/cart")
+    assert f"removeFromCart?productId={product_id}" in cart_response.text
+    clear_cart(session)
+    print("✓ Guest cart merged into the user's cart")
+
+
+def test_guest_cart_rejects_unknown_product(session):
+    """测试游客不能把不存在的商品加入购物车"""
+    print("Testing guest cart with unknown product...")
+
+    response = session.get(f"{BASE_URL}/addToCart?productId=99999999")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+
+    home_soup = BeautifulSoup(session.get(f"{BASE_URL}/").text, 'html.parser')
+    assert "CART 0" in home_soup.find('a', href='/cart').get_text()
+    print("✓ Unknown product not added to guest cart")
+
+
+def test_unauthorized_checkout(session):
+    """测试未登录时下单和订单页跳转到登录页"""
+    print("Testing unauthorized checkout...")
+
+    for path in ("/checkout", "/account/orders"):
+        response = session.get(f"{BASE_URL}{path}", allow_redirects=False)
+        assert response.status_code == 302, f"Expected 302, got {response.status_code}"
+        assert "/loginForm" in response.headers["Location"]
+    print("✓ Checkout requires login")
+
+
+def test_order_history(logged_in_user):
+    """测试订单历史页面"""
+    print("Testing order history page...")
+
+    response = logged_in_user.get(f"{BASE_URL}/account/orders")
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    print("✓ Order history page loads")
+
+
+# 1x1 的PNG，下单测试用自己添加的商品，不消耗示例商品的库存
+TEST_IMAGE = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8DwHwAFBQIAX8jx0gAAAABJRU5ErkJggg==')
+
+
+@pytest.fixture(scope="function")
+def test_product(session):
+    """添加一个商品，返回函数 make(stock) -> (productId, name)；测试结束后删除"""
+    created = []
+
+    def make(stock):
+        name = f"Checkout test item {uuid.uuid4().hex[:8]}"
+        category_id = re.search(r'displayCategory\?categoryId=(\d+)', session.get(f"{BASE_URL}/").text).group(1)
+        session.post(
+            f"{BASE_URL}/addItem",
+            data={"name": name, "price": "2.5", "description": "test", "stock": str(stock), "category": category_id},
+            files={"image": ("test.png", TEST_IMAGE, "image/png")},
+        )
+        rows = BeautifulSoup(session.get(f"{BASE_URL}/remove").text, 'html.parser').select('table tr')
+        product_id = next(row.find('td').get_text().strip() for row in rows if name in row.get_text())
+        created.append(product_id)
+        return product_id, name
+
+    yield make
+    # 先清空购物车再删商品，否则留下的购物车行会挂到之后复用这个 productId 的商品上
+    clear_cart(session)
+    for product_id in created:
+        session.get(f"{BASE_URL}/removeItem?productId={product_id}")
+
+
+def get_stock(session, product_id):
+    """商品页上显示的库存"""
+    soup = BeautifulSoup(session.get(f"{BASE_URL}/productDescription?productId={product_id}").text, 'html.parser')
+    label = soup.find('td', string='Stock')
+    return int(label.find_next_sibling('td').get_text().strip())
+
+
+def get_cart_count(session):
+    home_soup = BeautifulSoup(session.get(f"{BASE_URL}/").text, 'html.parser')
+    return int(re.search(r'CART (\d+)', home_soup.find('a', href='/cart').get_text()).group(1))
+
+
+def test_checkout_places_order(logged_in_user, test_product):
+    """测试下单：订单出现在订单历史里，购物车清空，库存减少"""
+    print("Testing checkout...")
+
+    product_id, name = test_product(2)
+    # 示例数据库里可能有已删除商品留下的购物车行，只比较增量
+    count = get_cart_count(logged_in_user)
+    logged_in_user.get(f"{BASE_URL}/addToCart?productId={product_id}")
+    assert get_cart_count(logged_in_user) == count + 1
+
+    response = logged_in_user.post(f"{BASE_URL}/checkout")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert "/account/orders" in response.url, "Should be sent to the order history"
+    assert name in response.text
+    assert get_cart_count(logged_in_user) == 0
+    assert get_stock(logged_in_user, product_id) == 1
+    print("✓ Order placed and stock decreased")
+
+
+def test_checkout_insufficient_stock(logged_in_user, test_product):
+    """测试库存不够时不下单，购物车保持不变"""
+    print("Testing checkout with insufficient stock...")
+
+    product_id, name = test_product(1)
+    count = get_cart_count(logged_in_user)
+    response = logged_in_user.post(f"{BASE_URL}/api/cart/batch", json={"operations": [
+        {"op": "set", "productId": int(product_id), "quantity": 3},
+    ]})
+    assert response.json()["noOfItems"] == count + 3
+
+    response = logged_in_user.post(f"{BASE_URL}/checkout")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert f"Not enough stock for: {name}" in response.text
+    assert name not in logged_in_user.get(f"{BASE_URL}/account/orders").text
+    assert get_cart_count(logged_in_user) == count + 3
+    print("✓ Checkout refused when stock is short")
+
+
+def test_order_history_huge_before(logged_in_user):
+    """测试 before 超出整数范围时不报错"""
+    print("Testing order history with a huge before...")
+
+    for before in (10 ** 20, -10 ** 20):
+        response = logged_in_user.get(f"{BASE_URL}/account/orders", params={"before": before})
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    print("✓ Huge before handled")
+
+
+def test_add_to_cart_unknown_product(logged_in_user):
+    """测试加入不存在的商品返回404，而不是提示没货"""
+    print("Testing add to cart with unknown product...")
+
+    response = logged_in_user.get(f"{BASE_URL}/addToCart?productId=99999999")
+    assert response.status_code == 404, f"Expected 404, got {response.status_code}"
+    print("✓ Unknown product rejected")
@@ -0,0 +1,118 @@
+import os
+import re
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+# 从环境变量读取BASE_URL
+BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
+
+
+@pytest.fixture(scope="function")
+def session():
+    """创建新的session对象"""
+    return requests.Session()
+
+
+def get_prices(response):
+    """从分类页面中取出所有商品价格"""
+    soup = BeautifulSoup(response.text, 'html.parser')
+    return [float(td.get_text().strip().lstrip('$')) for td in soup.select('#productPrice td')]
+
+
+def get_category_id(session):
+    """从首页侧栏获取第一个分类的ID"""
+    response = session.get(f"{BASE_URL}/")
+    match = re.search(r'displayCategory\?categoryId=(\d+)', response.text)
+    return match.group(1) if match else "1"
+
+
+def test_category_sorted_by_price(session):
+    """测试分类页按价格排序"""
+    print("Testing category sort by price...")
+
+    category_id = get_category_id(session)
+    response = session.get(f"{BASE_URL}/displayCategory", params={"categoryId": category_id, "sort": "price"})
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    prices = get_prices(response)
+    assert prices == sorted(prices)
+
+    response = session.get(f"{BASE_URL}/displayCategory", params={"categoryId": category_id, "sort": "price_desc"})
+    assert get_prices(response) == sorted(prices, reverse=True)
+    print("✓ Category pages sort by price")
+
+
+def test_category_price_filter(session):
+    """测试分类页的价格区间筛选"""
+    print("Testing category price filter...")
+
+    category_id = get_category_id(session)
+    prices = get_prices(session.get(f"{BASE_URL}/displayCategory", params={"categoryId": category_id}))
+    low = min(prices)
+    response = session.get(f"{BASE_URL}/displayCategory", params={"categoryId": category_id, "minPrice": low + 0.01})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert all(price > low for price in get_prices(response))
+    print("✓ Price filter excludes cheaper products")
+
+
+def test_unknown_category(session):
+    """测试不存在的分类"""
+    print("Testing unknown category...")
+
+    response = session.get(f"{BASE_URL}/displayCategory", params={"categoryId": 999999})
+
+    assert response.status_code == 404, f"Expected 404, got {response.status_code}"
+    print("✓ Unknown category returns 404")
+
+
+def test_sidebar_category_counts(session):
+    """测试首页侧栏显示每个分类的商品数"""
+    print("Testing sidebar category counts...")
+
+    soup = BeautifulSoup(session.get(f"{BASE_URL}/").text, 'html.parser')
+    items = [li.get_text().strip() for li in soup.select('.displayCategory li')]
+
+    assert len(items) > 0, "Sidebar should list categories"
+    assert all(re.search(r'\(\d+\)$', item) for item in items), f"Every category should show a count: {items}"
+    print("✓ Sidebar shows product counts")
+
+
+def test_product_images_lazy_loaded(session):
+    """测试目录页面的商品图片延迟加载"""
+    print("Testing lazy loaded product images...")
+
+    category_id = get_category_id(session)
+    for response in (session.get(f"{BASE_URL}/"), session.get(f"{BASE_URL}/displayCategory", params={"categoryId": category_id})):
+        images = BeautifulSoup(response.text, 'html.parser').select('img#itemImage')
+        assert len(images) > 0, "Page should show product images"
+        assert all(img.get('loading') == 'lazy' for img in images)
+        # 有缩略图时 srcset 里的每一项都带宽度
+        assert all(re.fullmatch(r'\S+ \d+w', part.strip()) for img in images for part in img.get('srcset', '').split(',') if part.strip())
+    print("✓ Product images are lazy loaded")
+
+
+def test_remove_page_lists_all_products(session):
+    """测试商品管理页每个商品一行"""
+    print("Testing remove page...")
+
+    response = session.get(f"{BASE_URL}/remove")
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    rows = BeautifulSoup(response.text, 'html.parser').select('table tr')
+    assert len(rows) > 0, "Remove page should list products"
+    for row in rows:
+        cells = row.find_all('td')
+        assert len(cells) == 6
+        product_id = cells[0].get_text().strip()
+        assert all(cell.a['href'] == f"/removeItem?productId={product_id}" for cell in cells)
+    print("✓ Remove page lists one product per row")
+
+
+def test_category_page_out_of_range(session):
+    """测试页码过大时返回400而不是500"""
+    print("Testing category page out of range...")
+
+    category_id = get_category_id(session)
+    response = session.get(f"{BASE_URL}/displayCategory", params={"categoryId": category_id, "page": 10 ** 20})
+    assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+    print("✓ Huge page number rejected")
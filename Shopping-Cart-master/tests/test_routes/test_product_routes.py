@@ -0,0 +1,50 @@
+import os
+import re
+import pytest
+import requests
+
+# 从环境变量读取BASE_URL
+BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
+
+
+@pytest.fixture(scope="function")
+def session():
+    """创建新的session对象"""
+    return requests.Session()
+
+
+def get_category_id(session):
+    """从首页侧栏获取第一个分类的ID"""
+    response = session.get(f"{BASE_URL}/")
+    match = re.search(r'displayCategory\?categoryId=(\d+)', response.text)
+    return match.group(1) if match else "1"
+
+
+def test_add_item_rejects_nan_price(session):
+    """测试价格为 nan 的商品不会被添加，目录页面照常显示"""
+    print("Testing add item with NaN price...")
+
+    category_id = get_category_id(session)
+    name = "NaN price test item"
+    response = session.post(
+        f"{BASE_URL}/addItem",
+        data={"name": name, "price": "nan", "description": "test", "stock": "1", "category": category_id},
+        files={"image": ("nan.png", b"not really a png", "image/png")},
+    )
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+
+    for url in (f"{BASE_URL}/", f"{BASE_URL}/displayCategory?categoryId={category_id}"):
+        page = session.get(url)
+        assert page.status_code == 200, f"{url}: expected 200, got {page.status_code}"
+        assert name not in page.text
+    print("✓ NaN price rejected")
+
+
+def test_unknown_product_description(session):
+    """测试不存在的商品页返回404"""
+    print("Testing unknown product page...")
+
+    for params in ({"productId": 99999999}, {}):
+        response = session.get(f"{BASE_URL}/productDescription", params=params)
+        assert response.status_code == 404, f"Expected 404, got {response.status_code}"
+    print("✓ Unknown product page returns 404")
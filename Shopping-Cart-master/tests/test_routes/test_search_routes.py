@@ -0,0 +1,90 @@
+import os
+import re
+import pytest
+import requests
+from bs4 import BeautifulSoup
+
+# 从环境变量读取BASE_URL
+BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
+
+
+@pytest.fixture(scope="function")
+def session():
+    """创建新的session对象"""
+    return requests.Session()
+
+
+def get_product_ids(response):
+    """从结果页面中取出所有商品ID"""
+    return re.findall(r'productId=(\d+)', response.text)
+
+
+def test_search_by_name(session):
+    """测试搜索结果：名称匹配的商品排在描述匹配的前面"""
+    print("Testing product search...")
+
+    response = session.get(f"{BASE_URL}/search", params={"searchQuery": "book"})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    soup = BeautifulSoup(response.text, 'html.parser')
+    names = [td.get_text().strip().lower() for td in soup.select('#productName td')]
+    assert len(names) > 0, "Should find at least one product"
+    matched = [("book" in name) for name in names]
+    assert matched[0], "Name matches should be ranked first"
+    assert matched == sorted(matched, reverse=True), f"Name matches should come before description matches: {names}"
+    print("✓ Search returns ranked matching products")
+
+
+def test_search_prefix(session):
+    """测试前缀搜索"""
+    print("Testing prefix search...")
+
+    full = get_product_ids(session.get(f"{BASE_URL}/search", params={"searchQuery": "book"}))
+    prefix = get_product_ids(session.get(f"{BASE_URL}/search", params={"searchQuery": "boo"}))
+
+    assert prefix == full
+    print("✓ Prefix search matches full word")
+
+
+def test_search_no_results(session):
+    """测试没有结果的搜索"""
+    print("Testing search without results...")
+
+    response = session.get(f"{BASE_URL}/search", params={"searchQuery": "zzzznotaproduct"})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    assert "No products found" in response.text
+    assert get_product_ids(response) == []
+    print("✓ Empty search result handled correctly")
+
+
+def test_search_special_characters(session):
+    """测试特殊字符不会导致服务器错误"""
+    print("Testing search with special characters...")
+
+    response = session.get(f"{BASE_URL}/search", params={"searchQuery": '"book* AND (OR'})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    print("✓ Special characters handled correctly")
+
+
+def test_search_page_out_of_range(session):
+    """测试页码过大时返回400而不是500"""
+    print("Testing search page out of range...")
+
+    response = session.get(f"{BASE_URL}/search", params={"searchQuery": "a", "page": 10 ** 20})
+    assert response.status_code == 400, f"Expected 400, got {response.status_code}"
+    print("✓ Huge page number rejected")
+
+
+def test_suggest(session):
+    """测试搜索框输入联想"""
+    print("Testing search suggestions...")
+
+    response = session.get(f"{BASE_URL}/suggest", params={"q": "boo"})
+
+    assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+    names = [item["name"].lower() for item in response.json()["suggestions"]]
+    assert len(names) > 0, "Should suggest at least one product"
+    assert all(name.startswith("boo") or " boo" in name for name in names)
+    print("✓ Suggestions match the typed prefix")
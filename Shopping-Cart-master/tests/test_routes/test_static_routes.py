@@ -0,0 +1,73 @@
+import os
+import re
+import pytest
+import requests
+
+# 从环境变量读取BASE_URL
+BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
+
+
+@pytest.fixture(scope="function")
+def session():
+    """创建新的session对象"""
+    return requests.Session()
+
+
+def get_static_urls(session):
+    """首页引用的CSS、JS和图片地址"""
+    response = session.get(f"{BASE_URL}/")
+    return sorted(set(re.findall(r'/static/(?:css|js|images)/[^\s"\'>]+', response.text)))
+
+
+def test_fingerprinted_static_urls(session):
+    """测试静态文件地址带内容哈希并长期缓存"""
+    print("Testing fingerprinted static URLs...")
+
+    urls = get_static_urls(session)
+    assert len(urls) > 0, "Home page should reference static files"
+    for url in urls:
+        assert re.search(r'\.[0-9a-f]{12}\.\w+$', url), f"{url} should carry a content hash"
+        response = session.get(f"{BASE_URL}{url}")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        cache_control = response.headers.get('Cache-Control', '')
+        assert 'immutable' in cache_control and 'max-age=31536000' in cache_control
+    print("✓ Static files are fingerprinted and cached for a year")
+
+
+def test_precompressed_static_files(session):
+    """测试客户端接受gzip时返回预先压缩的文件"""
+    print("Testing precompressed static files...")
+
+    url = next(url for url in get_static_urls(session) if url.endswith('.css'))
+    compressed = session.get(f"{BASE_URL}{url}", headers={'Accept-Encoding': 'gzip'})
+    plain = session.get(f"{BASE_URL}{url}", headers={'Accept-Encoding': 'identity'})
+
+    assert compressed.headers.get('Content-Encoding') == 'gzip'
+    assert 'Accept-Encoding' in compressed.headers.get('Vary', '')
+    assert plain.headers.get('Content-Encoding') is None
+    # requests 会自动解压，两次拿到的内容应该一样
+    assert compressed.content == plain.content
+    print("✓ Precompressed gzip served when accepted")
+
+
+def test_static_files_skip_session(session):
+    """测试带着session cookie请求静态文件时不读session"""
+    print("Testing static files skip the session store...")
+
+    home = session.get(f"{BASE_URL}/")
+    product_id = re.search(r'productId=(\d+)', home.text).group(1)
+    # 游客加入购物车后才有session cookie
+    session.get(f"{BASE_URL}/addToCart?productId={product_id}")
+    assert session.cookies.get('session'), "Guest should have a session cookie"
+
+    urls = get_static_urls(session)
+    before = session.get(f"{BASE_URL}/debug-session-store").json()
+    for url in urls:
+        response = session.get(f"{BASE_URL}{url}")
+        assert response.status_code == 200, f"Expected 200, got {response.status_code}"
+        assert 'Set-Cookie' not in response.headers
+    after = session.get(f"{BASE_URL}/debug-session-store").json()
+
+    # 只有第二次 /debug-session-store 读了一次session
+    assert after['hits'] + after['misses'] == before['hits'] + before['misses'] + 1
+    print("✓ Static requests do not load the session")
@@ -0,0 +1,40 @@
+import random
+
+from autocomplete import PrefixIndex
+
+
+def expected(names, prefix):
+    """逐个名称检查，和索引的结果对比"""
+    return {productId for productId, name in names.items()
+            if any(' '.join(name.lower().split()[i:]).startswith(prefix) for i in range(len(name.split())))}
+
+
+def test_search_matches_word_starts():
+    """测试从任意单词开头匹配，大小写和多余空白不影响"""
+    index = PrefixIndex()
+    index.load([(1, 'T Shirt 1'), (2, 'Book  One'), (3, 'the book of tea')])
+
+    assert [productId for productId, name in index.search('shi')] == [1]
+    assert {productId for productId, name in index.search('BOOK o')} == {2, 3}
+    assert index.search('book one') == [(2, 'Book  One')]
+    assert index.search('hirt') == []
+    assert index.search('  ') == []
+
+
+def test_add_and_remove_keep_index_consistent():
+    """测试增删之后的结果和逐个检查名称一致"""
+    random.seed(1)
+    words = ['red', 'blue', 'shirt', 'book', 'tea', 't', 'bo', 'boot']
+    rows = [(i, ' '.join(random.choice(words) for _ in range(random.randint(1, 5)))) for i in range(600)]
+    index = PrefixIndex()
+    index.load(rows[:300])
+    for productId, name in rows[300:]:
+        index.add(productId, name)
+    for productId, name in rows[:150]:
+        index.remove(productId)
+    index.remove(-1)
+
+    names = dict(rows[150:])
+    for prefix in ('b', 'bo', 'boo', 'book t', 't', 'red blue', 'z'):
+        assert {productId for productId, name in index.search(prefix, limit=len(rows))} == expected(names, prefix)
+    assert index.stats()['products'] == len(names)
@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import shutil
+
+import pytest
+
+import bulk
+
+# 从项目自带的数据库复制一份，迁移和导入都在副本上做
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """迁移好的临时数据库连接"""
+    path = str(tmp_path / 'database.db')
+    shutil.copy(os.path.join(project_root, 'database.db'), path)
+    conn = bulk.connect(path)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def category(conn):
+    """第一个分类的名字"""
+    return conn.execute('SELECT name FROM categories ORDER BY categoryId').fetchone()[0]
+
+
+def write_csv(path, category, count, extra=()):
+    lines = ['name,price,description,image,stock,category']
+    lines += ['Bulk item {},{}.5,desc,,3,{}'.format(i, i, category) for i in range(count)]
+    lines += list(extra)
+    path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+    return str(path)
+
+
+def imported_names(conn):
+    return [name for name, in conn.execute("SELECT name FROM products WHERE name LIKE 'Bulk item %' ORDER BY productId")]
+
+
+def test_import_csv(conn, category, tmp_path):
+    """测试CSV导入，价格为 nan/inf 的行被跳过"""
+    path = write_csv(tmp_path / 'products.csv', category, 5, [
+        'Bad nan,nan,desc,,1,{}'.format(category),
+        'Bad inf,inf,desc,,1,{}'.format(category),
+    ])
+    imported, skipped = bulk.importFile(conn, path, batch=2, transaction=3, log=io.StringIO())
+
+    assert (imported, skipped) == (5, 2)
+    assert imported_names(conn) == ['Bulk item {}'.format(i) for i in range(5)]
+    assert conn.execute('SELECT count(*) FROM products WHERE price IS NULL').fetchone()[0] == 0
+    assert conn.execute('SELECT count(*) FROM import_progress').fetchone()[0] == 0
+    # 全文索引和分类计数由 catchUp 补齐
+    assert conn.execute("SELECT count(*) FROM products_fts WHERE products_fts MATCH 'Bulk'").fetchone()[0] == 5
+    assert conn.execute('SELECT products FROM category_counts JOIN categories USING (categoryId) WHERE categories.name = ?', (category, )).fetchone()[0] == \
+        conn.execute('SELECT count(*) FROM products JOIN categories USING (categoryId) WHERE categories.name = ?', (category, )).fetchone()[0]
+
+
+def test_import_resume(conn, category, tmp_path, monkeypatch):
+    """测试导入中途失败后用 resume 继续，已提交的部分不会重复导入"""
+    path = write_csv(tmp_path / 'products.csv', category, 7)
+    catchUp = bulk.catchUp
+    calls = []
+
+    def failSecondTransaction(conn, lastId):
+        calls.append(lastId)
+        if len(calls) == 2:
+            raise RuntimeError('interrupted')
+        catchUp(conn, lastId)
+
+    monkeypatch.setattr(bulk, 'catchUp', failSecondTransaction)
+    with pytest.raises(RuntimeError):
+        bulk.importFile(conn, path, batch=2, transaction=3, log=io.StringIO())
+    # 第一个事务提交了，第二个回滚
+    assert len(imported_names(conn)) == 3
+    assert conn.execute('SELECT rowsDone FROM import_progress').fetchone()[0] == 3
+
+    monkeypatch.setattr(bulk, 'catchUp', catchUp)
+    with pytest.raises(ValueError):
+        bulk.importFile(conn, path, log=io.StringIO())
+    imported, skipped = bulk.importFile(conn, path, batch=2, transaction=3, resume=True, log=io.StringIO())
+
+    assert (imported, skipped) == (4, 0)
+    assert imported_names(conn) == ['Bulk item {}'.format(i) for i in range(7)]
+    assert conn.execute('SELECT count(*) FROM import_progress').fetchone()[0] == 0
+
+
+def test_export_and_import_jsonl(conn, category, tmp_path):
+    """测试导出JSONL再导入，商品内容不变"""
+    path = write_csv(tmp_path / 'products.csv', category, 3)
+    bulk.importFile(conn, path, log=io.StringIO())
+
+    exported = str(tmp_path / 'products.jsonl')
+    count = bulk.exportFile(conn, exported)
+    assert count == conn.execute('SELECT count(*) FROM products').fetchone()[0]
+    with open(exported, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if 'Bulk item' in line]
+    assert [record['name'] for record in records] == ['Bulk item {}'.format(i) for i in range(3)]
+    assert records[0]['category'] == category and records[0]['price'] == 0.5
+
+    conn.execute("DELETE FROM products WHERE name LIKE 'Bulk item %'")
+    subset = tmp_path / 'subset.jsonl'
+    subset.write_text(''.join(json.dumps(record) + '\n' for record in records) + '{"name": "Bad", "price": NaN, "stock": 1}\n', encoding='utf-8')
+    imported, skipped = bulk.importFile(conn, str(subset), log=io.StringIO())
+    assert (imported, skipped) == (3, 1)
+    assert imported_names(conn) == ['Bulk item {}'.format(i) for i in range(3)]
@@ -0,0 +1,94 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import changelog
+import db
+
+# 在项目自带数据库的副本上测试
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+@pytest.fixture
+def app(tmp_path):
+    """只有连接池配置的应用，数据库是迁移好的临时副本"""
+    path = str(tmp_path / 'database.db')
+    shutil.copy(os.path.join(project_root, 'database.db'), path)
+    app = Flask(__name__)
+    app.config['DATABASE'] = path
+    db.init_app(app)
+    db.get_pool(app)
+    yield app
+    db.get_pool(app).close()
+
+
+@pytest.fixture
+def watcher(app):
+    """订阅了 products 的 ChangeWatcher，收到的改动记在 watcher.received 里"""
+    watcher = changelog.ChangeWatcher(app)
+    watcher.received = []
+    watcher.subscribe('products', lambda keys, changeId: watcher.received.append(keys))
+    watcher.check()
+    yield watcher
+    watcher.stop()
+
+
+def rename_product(app, productId, name):
+    """用另一个连接改商品，相当于另一个进程的提交"""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    with conn:
+        conn.execute('UPDATE products SET name = ? WHERE productId = ?', (name, productId))
+    conn.close()
+
+
+class FailingConnection:
+    """读 change_log 时报错的连接，模拟数据库忙"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, *args):
+        if 'change_log' in sql:
+            raise sqlite3.OperationalError('database is locked')
+        return self.conn.execute(sql, *args)
+
+
+def test_check_dispatches_changes(app, watcher):
+    """测试其他连接提交后，下一次 check 把改动的主键交给订阅者"""
+    rename_product(app, 2, 'Renamed')
+    watcher.check()
+    assert watcher.received == [{2}]
+    # 没有新的提交时不会再分发
+    watcher.check()
+    assert watcher.received == [{2}]
+
+
+def test_failed_read_is_retried(app, watcher):
+    """测试读日志失败时不记下版本号，下一次 check 会重新读到这些改动"""
+    rename_product(app, 2, 'Renamed')
+    conn = watcher._conn
+    watcher._conn = FailingConnection(conn)
+    watcher.check()
+    assert watcher.received == []
+
+    watcher._conn = conn
+    watcher.check()
+    assert watcher.received == [{2}]
+
+
+def test_prune_runs_outside_check(app, watcher, monkeypatch):
+    """测试 check 不删日志，清理由 prune 单独完成"""
+    monkeypatch.setattr(changelog, 'KEEP_CHANGES', 1)
+    for name in ('A', 'B', 'C'):
+        rename_product(app, 2, name)
+    watcher.check()
+    conn = sqlite3.connect(app.config['DATABASE'])
+    count = conn.execute('SELECT count(*) FROM change_log').fetchone()[0]
+    assert count >= 3
+
+    assert watcher.prune() == count - 1
+    assert conn.execute('SELECT count(*) FROM change_log').fetchone()[0] == 1
+    conn.close()
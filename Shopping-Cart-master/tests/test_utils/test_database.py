@@ -0,0 +1,61 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import database
+import db
+
+# 迁移在项目自带数据库的副本上做
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """迁移好的临时数据库连接"""
+    path = str(tmp_path / 'database.db')
+    shutil.copy(os.path.join(project_root, 'database.db'), path)
+    conn = sqlite3.connect(path)
+    database.migrate(conn)
+    yield conn
+    conn.close()
+
+
+def counts(conn):
+    return dict(conn.execute('SELECT categoryId, products FROM category_counts'))
+
+
+def test_category_counts_skip_products_without_category(conn):
+    """测试没有分类的商品不会在 category_counts 里多出一行"""
+    before = counts(conn)
+    with conn:
+        productId = conn.execute("INSERT INTO products (name, price, stock, categoryId) VALUES ('No category', 1, 1, NULL)").lastrowid
+    assert counts(conn) == before
+
+    categoryId = min(before)
+    with conn:
+        conn.execute('UPDATE products SET categoryId = ? WHERE productId = ?', (categoryId, productId))
+    assert counts(conn) == {**before, categoryId: before[categoryId] + 1}
+    with conn:
+        conn.execute('UPDATE products SET categoryId = NULL WHERE productId = ?', (productId, ))
+    assert counts(conn) == before
+
+
+def test_read_only_database_must_be_migrated(tmp_path):
+    """测试只读打开没迁移的库时在建连接池时就报错"""
+    path = str(tmp_path / 'database.db')
+    shutil.copy(os.path.join(project_root, 'database.db'), path)
+    app = Flask(__name__)
+    app.config['DATABASE'] = 'file:{}?mode=ro'.format(path)
+    db.init_app(app)
+    with pytest.raises(database.SchemaError):
+        db.get_pool(app)
+
+    conn = sqlite3.connect(path)
+    database.migrate(conn)
+    conn.close()
+    pool = db.get_pool(app)
+    assert pool.database == app.config['DATABASE']
+    pool.close()